@@ -0,0 +1,228 @@
+"""
+Process-wide admission control for serving endpoint calls.
+
+Every Streamlit session used to call the endpoint straight from its script
+thread, so a classroom asking at once meant as many concurrent generations,
+a wave of 429s and then a wave of retries. Now each endpoint gets a limit
+on concurrent requests (streams hold their slot until they end). Requests
+over the limit wait in a bounded queue that is fair across sessions: slots
+are handed out round-robin over the sessions with waiting requests, so one
+impatient session can't starve the others.
+
+Waiting happens on the caller's thread, polling about once a second and
+reporting the queue position and an estimated wait through `on_queue`, so
+a Streamlit run can show them and still be interrupted (Stop generating, or
+a new prompt). The wait counts against the request's deadline.
+
+    ADMISSION_MAX_CONCURRENT=8              default limit per endpoint (0 = unlimited)
+    ADMISSION_ENDPOINT_LIMITS=a=4,b=16      per-endpoint overrides
+    ADMISSION_MAX_QUEUE=200                 waiting requests per endpoint
+    ADMISSION_MAX_QUEUED_PER_SESSION=2      waiting requests per session
+"""
+import functools
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from deadlines import WAIT_POLL_SECONDS, Deadline
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+ADMISSION_MAX_QUEUED_PER_SESSION = int(os.getenv("ADMISSION_MAX_QUEUED_PER_SESSION", "2"))
+# Assumed slot hold time until real requests have been timed
+ADMISSION_INITIAL_HOLD_SECONDS = float(os.getenv("ADMISSION_INITIAL_HOLD_SECONDS", "15"))
+# Weight of the newest hold time in the moving average used for wait estimates
+HOLD_TIME_SMOOTHING = 0.2
+
+
+def _parse_endpoint_limits(value):
+    """'endpoint-a=4,endpoint-b=16' -> {'endpoint-a': 4, 'endpoint-b': 16}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, limit = item.rpartition("=")
+        try:
+            limits[name.strip()] = int(limit)
+        except ValueError:
+            logger.warning(f"Ignoring malformed ADMISSION_ENDPOINT_LIMITS entry: {item!r}")
+    return limits
+
+
+ADMISSION_ENDPOINT_LIMITS = _parse_endpoint_limits(os.getenv("ADMISSION_ENDPOINT_LIMITS", ""))
+
+
+class AdmissionRejected(Exception):
+    """The endpoint's queue is full, or the session already has too many requests waiting."""
+
+
+class _Ticket:
+    __slots__ = ("session_id", "granted_at", "released")
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.granted_at = None
+        self.released = False
+
+
+class EndpointGate:
+    """Concurrency limit and fair per-session queue for one endpoint."""
+
+    def __init__(self, limit, max_queue=ADMISSION_MAX_QUEUE, max_queued_per_session=ADMISSION_MAX_QUEUED_PER_SESSION):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_queued_per_session = max_queued_per_session
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queued = 0
+        # session id -> its waiting tickets; the first session is served next
+        self._queues = OrderedDict()
+        self._hold_seconds = ADMISSION_INITIAL_HOLD_SECONDS
+
+    def stats(self):
+        with self._cond:
+            return {"limit": self.limit, "active": self._active, "queued": self._queued,
+                    "hold_seconds": round(self._hold_seconds, 3)}
+
+    def acquire(self, session_id, deadline, on_queue=None):
+        """
+        Wait for a slot. Calls `on_queue(position, estimated_seconds)` about once
+        a second while queued and `on_queue(None, None)` once admitted.
+        """
+        ticket = _Ticket(session_id)
+        with self._cond:
+            if self._active < self.limit and not self._queues:
+                self._grant(ticket)
+                return ticket
+            waiting = self._queues.get(session_id, ())
+            if len(waiting) >= self.max_queued_per_session:
+                raise AdmissionRejected("This session already has a question waiting for the endpoint")
+            if self._queued >= self.max_queue:
+                raise AdmissionRejected("Too many questions are waiting for the endpoint")
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._queued += 1
+
+        try:
+            while True:
+                with self._cond:
+                    if ticket.granted_at is None:
+                        deadline.check()
+                        self._cond.wait(min(WAIT_POLL_SECONDS, deadline.remaining()))
+                    if ticket.granted_at is not None:
+                        break
+                    position = self._position(ticket)
+                    estimate = self._estimated_wait(position)
+                if on_queue is not None:
+                    on_queue(position, estimate)
+            if on_queue is not None:
+                on_queue(None, None)
+        except BaseException:
+            # Deadline passed, or the run was interrupted while waiting
+            self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket):
+        """Give back a granted slot, or leave the queue. Safe to call more than once."""
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted_at is not None:
+                self._active -= 1
+                held = time.monotonic() - ticket.granted_at
+                self._hold_seconds += HOLD_TIME_SMOOTHING * (held - self._hold_seconds)
+            else:
+                waiting = self._queues.get(ticket.session_id)
+                if waiting is not None and ticket in waiting:
+                    waiting.remove(ticket)
+                    self._queued -= 1
+                    if not waiting:
+                        del self._queues[ticket.session_id]
+            self._dispatch()
+
+    def _grant(self, ticket):
+        ticket.granted_at = time.monotonic()
+        self._active += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiting sessions in round-robin order. Lock held."""
+        while self._active < self.limit and self._queues:
+            session_id, waiting = self._queues.popitem(last=False)
+            self._grant(waiting.popleft())
+            self._queued -= 1
+            if waiting:
+                # The session's next request goes behind everyone else's
+                self._queues[session_id] = waiting
+        self._cond.notify_all()
+
+    def _position(self, ticket):
+        """1-based place in line under round-robin order. Lock held."""
+        waiting = self._queues[ticket.session_id]
+        rounds = waiting.index(ticket)
+        position = rounds + 1
+        before = True
+        for session_id, others in self._queues.items():
+            if session_id == ticket.session_id:
+                before = False
+                continue
+            # Sessions ahead in the rotation get one more turn before ours
+            position += min(len(others), rounds + 1 if before else rounds)
+        return position
+
+    def _estimated_wait(self, position):
+        return math.ceil(position / max(1, self.limit)) * self._hold_seconds
+
+
+class AdmissionController:
+    """Lazily created EndpointGates, one per endpoint name."""
+
+    def __init__(self, default_limit=ADMISSION_MAX_CONCURRENT, endpoint_limits=None):
+        self.default_limit = default_limit
+        self.endpoint_limits = dict(ADMISSION_ENDPOINT_LIMITS if endpoint_limits is None else endpoint_limits)
+        self._lock = threading.Lock()
+        self._gates = {}
+
+    def gate(self, endpoint_name):
+        """The endpoint's gate, or None when its requests aren't limited."""
+        limit = self.endpoint_limits.get(endpoint_name, self.default_limit)
+        if limit <= 0:
+            return None
+        with self._lock:
+            gate = self._gates.get(endpoint_name)
+            if gate is None:
+                gate = self._gates[endpoint_name] = EndpointGate(limit)
+            return gate
+
+    def acquire(self, endpoint_name, session_id=None, deadline=None, on_queue=None):
+        """Wait for one of the endpoint's slots; returns the function that gives it back."""
+        gate = self.gate(endpoint_name)
+        if gate is None:
+            return lambda: None
+        started = time.monotonic()
+        try:
+            ticket = gate.acquire(session_id or uuid.uuid4().hex, deadline or Deadline(), on_queue)
+        except AdmissionRejected:
+            metrics.increment("chatbot_admission_rejected_total", endpoint=endpoint_name)
+            raise
+        metrics.observe("chatbot_admission_wait_seconds", time.monotonic() - started, endpoint=endpoint_name)
+        return functools.partial(gate.release, ticket)
+
+    @contextmanager
+    def slot(self, endpoint_name, session_id=None, deadline=None, on_queue=None):
+        """Hold one of the endpoint's slots for the duration of the block."""
+        release = self.acquire(endpoint_name, session_id, deadline, on_queue)
+        try:
+            yield
+        finally:
+            release()
+
+
+# Shared by every session in this process
+admission_controller = AdmissionController()
@@ -0,0 +1,132 @@
+"""
+App configuration, resolved once per process.
+
+SERVING_ENDPOINT, DATABRICKS_HOST and DATABRICKS_TOKEN come from environment
+variables first and Streamlit secrets second. Resolving them (and logging
+about it) used to happen on every rerun; now the result is kept in an
+immutable AppConfig and only re-resolved when a secrets file changes.
+
+DATABRICKS_HOST may be given as a bare workspace name
+("adb-123.azuredatabricks.net"): https:// is added and a trailing slash
+dropped. Only a value that can't be read as a host is reported.
+"""
+import logging
+import os
+import threading
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+CONFIG_KEYS = ("SERVING_ENDPOINT", "DATABRICKS_HOST", "DATABRICKS_TOKEN")
+
+
+def normalize_host(value):
+    """
+    The workspace URL for a DATABRICKS_HOST value, with https:// added if it
+    has no scheme and without a trailing slash; None if it isn't a host.
+    """
+    value = (value or "").strip()
+    if "://" not in value:
+        value = f"https://{value}"
+    value = value.rstrip("/")
+    try:
+        parts = urlsplit(value)
+        parts.port  # raises on a port that isn't a number
+    except ValueError:
+        return None
+    if parts.scheme not in ("https", "http") or not parts.hostname or any(c.isspace() for c in value):
+        return None
+    return value
+
+
+class AppConfig(NamedTuple):
+    """Resolved app settings; None means the setting was not found."""
+    serving_endpoint: Optional[str]
+    databricks_host: Optional[str]
+    databricks_token: Optional[str]
+
+    def auth_problems(self):
+        """Human-readable problems with the Databricks authentication settings."""
+        problems = []
+        if not self.databricks_host:
+            problems.append("`DATABRICKS_HOST` is not set")
+        elif normalize_host(self.databricks_host) is None:
+            problems.append(f"`DATABRICKS_HOST` is not a workspace URL: `{self.databricks_host}`")
+        if not self.databricks_token:
+            problems.append("`DATABRICKS_TOKEN` is not set")
+        return problems
+
+
+def _secrets_signature():
+    """Modification times of the secrets files, used to detect edits."""
+    try:
+        paths = st.config.get_option("secrets.files")
+    except Exception:
+        paths = []
+    signature = []
+    for path in paths:
+        try:
+            signature.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            signature.append((path, None))
+    return tuple(signature)
+
+
+def _resolve():
+    values = {key: os.getenv(key) for key in CONFIG_KEYS}
+    missing = [key for key, value in values.items() if not value]
+    if missing:
+        try:
+            for key in missing:
+                if key in st.secrets:
+                    values[key] = st.secrets[key]
+                else:
+                    logger.warning(f"{key} not found in environment or Streamlit secrets")
+        except Exception as e:
+            # st.secrets raises when there is no secrets file at all
+            logger.warning(f"Could not read Streamlit secrets: {e}")
+
+    host = (values["DATABRICKS_HOST"] or "").strip() or None
+    config = AppConfig(
+        serving_endpoint=values["SERVING_ENDPOINT"] or None,
+        # Kept as given if it can't be normalized, so auth_problems can show it
+        databricks_host=host and (normalize_host(host) or host),
+        databricks_token=values["DATABRICKS_TOKEN"] or None,
+    )
+
+    # databricks-sdk and the MLflow deploy client read credentials from the environment
+    if config.databricks_host and normalize_host(config.databricks_host):
+        os.environ["DATABRICKS_HOST"] = config.databricks_host
+    if config.databricks_token:
+        os.environ["DATABRICKS_TOKEN"] = config.databricks_token
+
+    logger.info(
+        "Loaded app config: "
+        + ", ".join(f"{key}={'set' if value else 'missing'}" for key, value in zip(CONFIG_KEYS, config))
+    )
+    return config
+
+
+_lock = threading.Lock()
+_cached = None  # (secrets signature, AppConfig)
+
+
+def load_config():
+    """Return the app config, resolving it again only if a secrets file changed."""
+    global _cached
+    signature = _secrets_signature()
+    with _lock:
+        if _cached is not None and _cached[0] == signature:
+            return _cached[1]
+        previous = _cached[1] if _cached is not None else None
+        config = _resolve()
+        _cached = (signature, config)
+
+    if previous is not None and previous != config:
+        # Clients built with the old credentials must not be reused
+        from client_registry import client_registry
+        client_registry.reset()
+    return config
@@ -0,0 +1,321 @@
+"""
+Replay benchmark for the client-side streaming parse/render pipeline.
+
+Recorded chunk traces are replayed, with no network involved, through the
+per-chunk work the app does while streaming:
+- ChatAgentChunk.model_validate and ResponsesAgentStreamEvent.model_validate,
+  and the fast-path parsers in stream_parsers.py that replace them
+- the stream accumulators, and reduce_chat_agent_chunks both once per turn
+  and re-run on every chunk as the app did before the accumulators
+- render_message, with Streamlit replaced by a headless stub
+- _convert_to_responses_format on the resulting history
+
+For each stage it reports CPU time per turn and per chunk, and the peak and
+retained memory allocated in one turn. render_message and
+_convert_to_responses_format run once per turn, so they count as a single
+chunk and their us/chunk is their time per turn.
+
+Without --trace, synthetic traces from mock_serving.py are used: short
+answers, 4k-token answers and tool-heavy agent runs for each endpoint format.
+Real traces can be captured with --record (using the configured endpoint) and
+replayed with --trace. Save a baseline with --save-baseline and compare
+later runs with --baseline to catch regressions:
+
+    python benchmark_replay.py --save-baseline .cache/replay_baseline.json
+    python benchmark_replay.py --baseline .cache/replay_baseline.json
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+from unittest import mock
+
+TRACE_SCENARIOS = (
+    # name, task type, mock endpoint settings
+    ("chat-short", "chat/completions", {"answer_tokens": 40}),
+    ("chat-4k", "chat/completions", {"answer_tokens": 4096}),
+    ("agent-short", "agent/v2/chat", {"answer_tokens": 40}),
+    ("agent-4k", "agent/v2/chat", {"answer_tokens": 4096}),
+    ("agent-tools", "agent/v2/chat", {"answer_tokens": 300, "tool_calls": 6}),
+    ("responses-short", "agent/v1/responses", {"answer_tokens": 40}),
+    ("responses-4k", "agent/v1/responses", {"answer_tokens": 4096}),
+    ("responses-tools", "agent/v1/responses", {"answer_tokens": 300, "tool_calls": 6}),
+)
+QUESTION = "Which forage grasses tolerate long dry seasons on acid soils?"
+
+
+class HeadlessStreamlit:
+    """Stand-in for the streamlit module in messages.py that only counts what would be sent."""
+
+    def __init__(self):
+        self.elements = 0
+        self.bytes = 0
+
+    def _element(self, body="", *args, **kwargs):
+        self.elements += 1
+        self.bytes += len(str(body))
+
+    markdown = code = caption = write = _element
+
+    def empty(self):
+        return self
+
+    @contextmanager
+    def container(self):
+        yield self
+
+
+def synthetic_traces():
+    from mock_serving import MockEndpointConfig, synthetic_trace
+
+    traces = []
+    for name, task_type, settings in TRACE_SCENARIOS:
+        chunks = synthetic_trace(MockEndpointConfig(task_type=task_type, seed=0, **settings))
+        traces.append({
+            "name": name,
+            "task_type": task_type,
+            "input_messages": [{"role": "user", "content": QUESTION}],
+            "chunks": chunks,
+        })
+    return traces
+
+
+def _responses_final_messages(events):
+    """Chat messages for the output items of a ResponsesAgent stream, as the app builds them."""
+    messages = []
+    for event in events:
+        item = event.get("item") if event.get("type") == "response.output_item.done" else None
+        if not item:
+            continue
+        if item.get("type") == "message":
+            for part in item.get("content", []):
+                if part.get("type") == "output_text" and part.get("text"):
+                    messages.append({"role": "assistant", "content": part["text"]})
+        elif item.get("type") == "function_call":
+            messages.append({"role": "assistant", "content": "", "tool_calls": [{
+                "id": item.get("call_id"), "type": "function",
+                "function": {"name": item.get("name"), "arguments": item.get("arguments", "")},
+            }]})
+        elif item.get("type") == "function_call_output":
+            messages.append({"role": "tool", "content": item.get("output", ""), "tool_call_id": item.get("call_id")})
+    return messages
+
+
+def pipeline_stages(trace):
+    """(stage name, callable, chunks per call; 1 for stages that run once per turn) for one trace."""
+    from mlflow.types.agent import ChatAgentChunk
+    from mlflow.types.responses import ResponsesAgentStreamEvent
+
+    from messages import render_message
+    from model_serving_utils import _convert_to_responses_format
+    from stream_parsers import parse_chat_agent_chunk, parse_responses_event
+    from stream_reducers import (
+        ChatAgentMessageAccumulator,
+        ResponsesOutputTextAccumulator,
+        _dump_message,
+        reduce_chat_agent_chunks,
+    )
+
+    task_type = trace["task_type"]
+    chunks = trace["chunks"]
+    stages = []
+
+    if task_type == "agent/v2/chat":
+        parsed = [ChatAgentChunk.model_validate(chunk) for chunk in chunks]
+        chunks_by_message = OrderedDict()
+        for chunk in parsed:
+            chunks_by_message.setdefault(chunk.delta.id, []).append(chunk)
+
+        def accumulate():
+            accumulators = OrderedDict()
+            for chunk in parsed:
+                accumulators.setdefault(chunk.delta.id, ChatAgentMessageAccumulator()).add(chunk.delta)
+            return [accumulator.message() for accumulator in accumulators.values()]
+
+        def reduce_every_chunk():
+            # What the app did before ChatAgentMessageAccumulator: re-reduce the message on each delta
+            groups = OrderedDict()
+            for chunk in parsed:
+                group = groups.setdefault(chunk.delta.id, [])
+                group.append(chunk)
+                partial = _dump_message(reduce_chat_agent_chunks(group))
+            return partial
+
+        stages.append(("ChatAgentChunk.model_validate",
+                       lambda: [ChatAgentChunk.model_validate(chunk) for chunk in chunks], len(chunks)))
+        stages.append(("parse_chat_agent_chunk",
+                       lambda: [parse_chat_agent_chunk(chunk) for chunk in chunks], len(chunks)))
+        stages.append(("ChatAgentMessageAccumulator", accumulate, len(chunks)))
+        stages.append(("reduce_chat_agent_chunks",
+                       lambda: [reduce_chat_agent_chunks(group) for group in chunks_by_message.values()],
+                       len(chunks)))
+        stages.append(("reduce_chat_agent_chunks every chunk", reduce_every_chunk, len(chunks)))
+        final_messages = [_dump_message(reduce_chat_agent_chunks(group)) for group in chunks_by_message.values()]
+
+    elif task_type == "agent/v1/responses":
+        def accumulate():
+            output_text = ResponsesOutputTextAccumulator()
+            for event in chunks:
+                if event.get("type") == "response.output_text.delta":
+                    output_text.add(event.get("item_id"), event.get("delta") or "")
+                elif event.get("type") == "response.output_item.done":
+                    output_text.finish(event["item"].get("id"))
+            return output_text
+
+        stages.append(("ResponsesAgentStreamEvent.model_validate",
+                       lambda: [ResponsesAgentStreamEvent.model_validate(event) for event in chunks], len(chunks)))
+        stages.append(("parse_responses_event",
+                       lambda: [parse_responses_event(event) for event in chunks], len(chunks)))
+        stages.append(("ResponsesOutputTextAccumulator", accumulate, len(chunks)))
+        final_messages = _responses_final_messages(chunks)
+
+    else:
+        def accumulate():
+            parts = []
+            for chunk in chunks:
+                if chunk.get("choices"):
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                    if content:
+                        parts.append(content)
+            return "".join(parts)
+
+        stages.append(("chat completions deltas", accumulate, len(chunks)))
+        final_messages = [{"role": "assistant", "content": accumulate()}]
+
+    history = list(trace.get("input_messages", [])) + final_messages
+    # Once per turn, not per chunk
+    stages.append(("render_message", lambda: [render_message(message) for message in final_messages], 1))
+    stages.append(("_convert_to_responses_format", lambda: _convert_to_responses_format(history), 1))
+    return stages
+
+
+def measure_stage(run, repeat):
+    """Median CPU seconds per call, and peak/retained bytes allocated by one call."""
+    run()  # warm up imports and pydantic schema caches
+    cpu_times = []
+    for _ in range(repeat):
+        started = time.process_time()
+        run()
+        cpu_times.append(time.process_time() - started)
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = run()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return statistics.median(cpu_times), peak - baseline, current - baseline
+
+
+def run_benchmark(traces, repeat):
+    # reduce_chat_agent_chunks stores tool calls as dicts, which pydantic warns about on every dump
+    warnings.filterwarnings("ignore", message="Pydantic serializer warnings")
+    headless = HeadlessStreamlit()
+    results = []
+    with mock.patch("messages.st", headless):
+        for trace in traces:
+            for stage, run, chunk_count in pipeline_stages(trace):
+                cpu_seconds, peak_bytes, retained_bytes = measure_stage(run, repeat)
+                results.append({
+                    "trace": trace["name"],
+                    "task_type": trace["task_type"],
+                    "stage": stage,
+                    "chunks": chunk_count,
+                    "cpu_ms_per_turn": round(cpu_seconds * 1000, 3),
+                    "cpu_us_per_chunk": round(cpu_seconds * 1e6 / max(1, chunk_count), 3),
+                    "peak_kib_per_turn": round(peak_bytes / 1024, 1),
+                    "retained_kib_per_turn": round(retained_bytes / 1024, 1),
+                })
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print per-stage changes against a baseline; return the stages that got slower than tolerated."""
+    previous = {(r["trace"], r["stage"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["trace"], result["stage"]))
+        if before is None or not before["cpu_ms_per_turn"]:
+            continue
+        change = result["cpu_ms_per_turn"] / before["cpu_ms_per_turn"] - 1
+        marker = ""
+        # Stages well under a tenth of a millisecond are mostly timer noise
+        if change > tolerance and result["cpu_ms_per_turn"] - before["cpu_ms_per_turn"] > 0.05:
+            marker = "  <-- regression"
+            regressions.append(result)
+        print(f"{result['trace']:<16} {result['stage']:<42} {before['cpu_ms_per_turn']:>10.3f} -> "
+              f"{result['cpu_ms_per_turn']:>10.3f} ms ({change:+.0%}){marker}")
+    return regressions
+
+
+def record_trace(path, task_type=None, question=QUESTION):
+    """Capture the raw chunks of one streamed answer from the configured endpoint."""
+    from app_config import load_config
+    from model_serving_utils import _get_endpoint_task_type, query_endpoint_stream
+
+    endpoint = load_config().serving_endpoint
+    task_type = task_type or _get_endpoint_task_type(endpoint)
+    input_messages = [{"role": "user", "content": question}]
+    chunks = list(query_endpoint_stream(endpoint, input_messages, return_traces=False, task_type=task_type))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"name": question[:30], "task_type": task_type, "input_messages": input_messages,
+                   "chunks": chunks}, f)
+    print(f"Recorded {len(chunks)} {task_type} chunks to {path}")
+
+
+def _print_results(results):
+    print(f"{'trace':<16} {'stage':<42} {'chunks':>6} {'ms/turn':>10} {'us/chunk':>9} "
+          f"{'peak KiB':>9} {'kept KiB':>9}")
+    for r in results:
+        print(f"{r['trace']:<16} {r['stage']:<42} {r['chunks']:>6} {r['cpu_ms_per_turn']:>10.3f} "
+              f"{r['cpu_us_per_chunk']:>9.3f} {r['peak_kib_per_turn']:>9.1f} {r['retained_kib_per_turn']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", action="append", default=[], help="recorded trace file (repeatable)")
+    parser.add_argument("--record", metavar="PATH", help="capture a trace from the configured endpoint and exit")
+    parser.add_argument("--question", default=QUESTION, help="question to ask when recording")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage (the median is reported)")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.record:
+        record_trace(args.record, question=args.question)
+        return 0
+
+    traces = []
+    for path in args.trace:
+        with open(path, encoding="utf-8") as f:
+            traces.append(json.load(f))
+    results = run_benchmark(traces or synthetic_traces(), args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_results(results)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stages regressed by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
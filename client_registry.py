@@ -0,0 +1,124 @@
+"""
+Process-wide registry of API clients.
+
+Building a WorkspaceClient resolves configuration and authentication and
+opens a fresh HTTP connection pool, so doing it per request adds config
+resolution and a TLS handshake to every turn. The registry builds each client
+once, hands the same instance to every Streamlit session, and recycles it
+after a configurable lifetime so long-lived connections and credentials are
+eventually renewed.
+
+databricks.sdk and mlflow take seconds to import, so they are only imported
+when a client is first built (warm_start.py does that in the background).
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive pool sizing for the Databricks SDK HTTP session
+DATABRICKS_MAX_CONNECTION_POOLS = int(os.getenv("DATABRICKS_MAX_CONNECTION_POOLS", "10"))
+DATABRICKS_MAX_CONNECTIONS_PER_POOL = int(os.getenv("DATABRICKS_MAX_CONNECTIONS_PER_POOL", "20"))
+# Seconds before a client (and its connections) is discarded and rebuilt
+CLIENT_MAX_AGE_SECONDS = float(os.getenv("CLIENT_MAX_AGE_SECONDS", "3600"))
+
+
+def _build_workspace_client():
+    from databricks.sdk import WorkspaceClient
+    from databricks.sdk.core import Config
+
+    config = Config(
+        max_connection_pools=DATABRICKS_MAX_CONNECTION_POOLS,
+        max_connections_per_pool=DATABRICKS_MAX_CONNECTIONS_PER_POOL,
+    )
+    return WorkspaceClient(config=config)
+
+
+def _build_deploy_client():
+    from mlflow.deployments import get_deploy_client as _mlflow_get_deploy_client
+
+    return _mlflow_get_deploy_client("databricks")
+
+
+class ClientRegistry:
+    """
+    Thread-safe, lazily populated cache of named clients with a maximum age.
+
+    Clients are built outside the registry lock, one build at a time per
+    name, so a slow first authentication only holds up callers waiting for
+    that same client. While an expired client is being rebuilt, other
+    callers keep getting the old one.
+    """
+
+    def __init__(self, max_age=CLIENT_MAX_AGE_SECONDS):
+        self._max_age = max_age
+        self._factories = {}
+        self._entries = {}  # name -> (client, created_at)
+        self._build_locks = {}  # name -> lock held while that client is built
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """Register (or replace) the factory used to build a named client."""
+        with self._lock:
+            self._factories[name] = factory
+            self._entries.pop(name, None)
+            self._build_locks.setdefault(name, threading.Lock())
+
+    def _fresh(self, name):
+        """The cached (client, created_at) entry and whether it is still young enough. Lock held."""
+        entry = self._entries.get(name)
+        return entry, entry is not None and time.monotonic() - entry[1] < self._max_age
+
+    def get(self, name):
+        """Return the shared client, building it if missing or too old."""
+        with self._lock:
+            entry, fresh = self._fresh(name)
+            if fresh:
+                return entry[0]
+            build_lock = self._build_locks[name]
+        if not build_lock.acquire(blocking=entry is None):
+            # Another caller is already recycling it; keep using the old one meanwhile
+            return entry[0]
+        try:
+            with self._lock:
+                # Someone else may have built it while we waited
+                entry, fresh = self._fresh(name)
+                if fresh:
+                    return entry[0]
+                factory = self._factories[name]
+            if entry is not None:
+                logger.info(f"Recycling {name} client after {self._max_age:.0f}s")
+            client = factory()
+            with self._lock:
+                # Don't publish a client from a factory that was replaced meanwhile
+                if self._factories.get(name) is factory:
+                    self._entries[name] = (client, time.monotonic())
+            return client
+        finally:
+            build_lock.release()
+
+    def reset(self, name=None):
+        """Drop one cached client, or all of them, so they are rebuilt on next use."""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+
+# Shared by every session in this process
+client_registry = ClientRegistry()
+client_registry.register("workspace", _build_workspace_client)
+client_registry.register("deploy", _build_deploy_client)
+
+
+def get_workspace_client():
+    """Get the shared Databricks WorkspaceClient."""
+    return client_registry.get("workspace")
+
+
+def get_deploy_client():
+    """Get the shared MLflow Databricks deployments client."""
+    return client_registry.get("deploy")
@@ -0,0 +1,161 @@
+"""
+Token-budgeted conversation context for model requests.
+
+Sending the entire session history on every turn makes each request larger
+than the last, until the endpoint's context limit rejects it. The builder
+here keeps the conversation within a token budget: system messages and the
+most recent turns are always sent, tool outputs in older turns are shortened,
+and older turns that still don't fit are dropped or folded into a summary.
+
+Token counts are estimated locally (about four characters per token), which
+is close enough for budgeting and costs no model call.
+"""
+import os
+
+from messages import UserMessage
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+# Turns (a user message and the responses to it) always sent verbatim
+CONTEXT_KEEP_RECENT_TURNS = int(os.getenv("CONTEXT_KEEP_RECENT_TURNS", "2"))
+# Tool outputs in older turns are cut down to roughly this many tokens
+CONTEXT_MAX_TOOL_OUTPUT_TOKENS = int(os.getenv("CONTEXT_MAX_TOOL_OUTPUT_TOKENS", "200"))
+# Fold dropped turns into a short summary instead of discarding them
+CONTEXT_SUMMARY = os.getenv("CONTEXT_SUMMARY", "true").lower() in ("1", "true", "yes")
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(message):
+    """Roughly estimate how many tokens a chat message or Responses input item costs."""
+    content = message.get("content") or message.get("output") or ""
+    if isinstance(content, list):
+        chars = sum(len(str(part.get("text") or "")) for part in content if isinstance(part, dict))
+    else:
+        chars = len(str(content))
+    chars += len(message.get("name") or "") + len(message.get("arguments") or "")
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        chars += len(function.get("name") or "") + len(function.get("arguments") or "")
+    return MESSAGE_OVERHEAD_TOKENS + chars // CHARS_PER_TOKEN
+
+
+def _is_tool_output(message):
+    return message.get("role") == "tool" or message.get("type") == "function_call_output"
+
+
+def _shorten_tool_output(message, max_tokens):
+    field = "output" if message.get("type") == "function_call_output" else "content"
+    content = str(message.get(field) or "")
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(content) <= max_chars:
+        return message
+    omitted = len(content) - max_chars
+    return {**message, field: f"{content[:max_chars]}\n...[{omitted} characters of tool output omitted]"}
+
+
+def summarize_turns(turns):
+    """
+    Build a short extractive summary of dropped turns without calling a model.
+
+    Keeps the first line of every user question, which is usually enough for
+    the model to resolve references like "that grass" in later questions.
+    """
+    questions = []
+    for turn in turns:
+        for message in turn:
+            if message.get("role") == "user" and message.get("content"):
+                first_line = str(message["content"]).strip().splitlines()[0]
+                questions.append(f"- {first_line[:200]}")
+    if not questions:
+        return None
+    return "Earlier in this conversation the user asked:\n" + "\n".join(questions)
+
+
+class ContextBuilder:
+    """
+    Build the list of input messages for a request from the session history.
+
+    `summarize` turns a list of dropped turns (each a list of chat messages)
+    into summary text, or None to disable summarization. Summaries are cached
+    per set of dropped history elements, so a long session only summarizes
+    again when another turn falls out of the budget.
+    """
+
+    def __init__(self, max_tokens=CONTEXT_MAX_TOKENS,
+                 keep_recent_turns=CONTEXT_KEEP_RECENT_TURNS,
+                 max_tool_output_tokens=CONTEXT_MAX_TOOL_OUTPUT_TOKENS,
+                 summarize=summarize_turns if CONTEXT_SUMMARY else None):
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.max_tool_output_tokens = max_tool_output_tokens
+        self.summarize = summarize
+        self._summary_cache = {}
+
+    def build(self, history, to_messages=None):
+        """
+        Flatten `history` (a list of Message objects) into budgeted input messages.
+
+        `to_messages` converts one history element and defaults to its
+        to_input_messages(); pass Message.to_responses_input to build
+        ResponsesAgent input items.
+        """
+        if to_messages is None:
+            to_messages = lambda element: element.to_input_messages()
+        system_messages, turns = self._split_turns(history, to_messages)
+
+        recent = turns[-self.keep_recent_turns:] if self.keep_recent_turns > 0 else []
+        older = turns[:len(turns) - len(recent)]
+
+        used = sum(estimate_tokens(m) for m in system_messages)
+        used += sum(estimate_tokens(m) for _, turn in recent for m in turn)
+
+        # Walk older turns newest first, keeping whole turns so tool calls stay
+        # paired with their outputs
+        kept = []
+        dropped = []
+        for elements, turn in reversed(older):
+            turn = [
+                _shorten_tool_output(m, self.max_tool_output_tokens) if _is_tool_output(m) else m
+                for m in turn
+            ]
+            cost = sum(estimate_tokens(m) for m in turn)
+            if not dropped and used + cost <= self.max_tokens:
+                kept.append((elements, turn))
+                used += cost
+            else:
+                dropped.append((elements, turn))
+        kept.reverse()
+        dropped.reverse()
+
+        input_messages = list(system_messages)
+        if dropped and self.summarize is not None:
+            summary = self._summary_for(dropped)
+            if summary:
+                input_messages.append({"role": "system", "content": summary})
+        for _, turn in kept + recent:
+            input_messages.extend(turn)
+        return input_messages
+
+    def _split_turns(self, history, to_messages):
+        """Group history into turns, each starting at a user message."""
+        system_messages = []
+        turns = []  # list of (elements, messages)
+        for element in history:
+            if isinstance(element, UserMessage) or not turns:
+                turns.append(([], []))
+            elements, turn = turns[-1]
+            elements.append(element)
+            for message in to_messages(element):
+                if message.get("role") == "system":
+                    system_messages.append(message)
+                else:
+                    turn.append(message)
+        return system_messages, turns
+
+    def _summary_for(self, dropped):
+        key = tuple(id(element) for elements, _ in dropped for element in elements)
+        if key not in self._summary_cache:
+            # Only the latest summary is ever reused
+            self._summary_cache = {key: self.summarize([turn for _, turn in dropped])}
+        return self._summary_cache[key]
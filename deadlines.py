@@ -0,0 +1,229 @@
+"""
+Deadlines and timeouts for endpoint calls.
+
+A stalled endpoint used to hold the Streamlit script thread forever. Every
+request now gets an overall deadline, and streams additionally have a
+time-to-first-token timeout and an idle timeout between chunks.
+
+Streams are read (and optionally parsed) on a background thread, so slow
+rendering on the script thread doesn't hold up socket reads, and the script
+thread only ever waits on a queue with a timeout. The queue is bounded: if
+rendering falls more than STREAM_QUEUE_MAX_CHUNKS behind, the reader stops
+reading and the connection's flow control pushes back on the endpoint
+instead of chunks piling up in memory. The consumer drains whatever is
+queued in one go and is told (on_drained) when it has caught up, which is
+when pending output may be rendered. Output coalescing can hold some of it
+back; on_drained then returns how long until it is due, and is called again
+after that if no chunk arrives first.
+
+When the consumer stops early (a timeout, an error, or Streamlit
+interrupting the run for "Stop generating" or a new prompt) the reader is
+told to stop, the queue is emptied so a reader blocked on it wakes up, and
+the reader closes the upstream generator, which releases the HTTP
+connection. A reader blocked on a silent socket can only notice once the
+read returns, which MLflow bounds with MLFLOW_HTTP_REQUEST_TIMEOUT (120s by
+default).
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "120"))
+FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv("FIRST_TOKEN_TIMEOUT_SECONDS", "45"))
+STREAM_IDLE_TIMEOUT_SECONDS = float(os.getenv("STREAM_IDLE_TIMEOUT_SECONDS", "30"))
+# How often a waiting consumer wakes up to check its timeouts and call on_wait
+WAIT_POLL_SECONDS = 1.0
+# Chunks read ahead of the consumer before the reader blocks, and the most
+# taken off the queue per wake-up
+STREAM_QUEUE_MAX_CHUNKS = int(os.getenv("STREAM_QUEUE_MAX_CHUNKS", "1024"))
+STREAM_DRAIN_MAX_CHUNKS = int(os.getenv("STREAM_DRAIN_MAX_CHUNKS", "256"))
+
+
+class StreamTimeoutError(TimeoutError):
+    """No first chunk, or no next chunk, arrived in time. A retry may succeed."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request as a whole ran out of time. Not worth retrying."""
+
+
+class Deadline:
+    """A point in time by which a request, retries included, must finish."""
+
+    def __init__(self, seconds=REQUEST_DEADLINE_SECONDS):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        """Raise DeadlineExceeded once the deadline has passed."""
+        if self.expired():
+            raise DeadlineExceeded(f"Request did not finish within {self.seconds:.0f}s")
+
+
+_END = object()
+
+
+def _put(out, item, stop):
+    """Put `item` on the bounded queue, giving up once `stop` is set; returns whether it was queued."""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=WAIT_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _pump(chunks, out, stop, parse=None):
+    """
+    Reader thread: move (parsed) chunks onto `out` until exhausted, failed or
+    told to stop. Items are (chunk, error, monotonic time the chunk arrived).
+    """
+    try:
+        for chunk in chunks:
+            received_at = time.monotonic()
+            if stop.is_set():
+                break
+            if parse is not None:
+                chunk = parse(chunk)
+            if not _put(out, (chunk, None, received_at), stop):
+                break
+        else:
+            _put(out, (_END, None, None), stop)
+    except BaseException as e:
+        _put(out, (_END, e, None), stop)
+    finally:
+        # Runs the upstream generator's cleanup, closing the HTTP response
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def guarded_stream(chunks, deadline=None, first_token_timeout=FIRST_TOKEN_TIMEOUT_SECONDS,
+                   idle_timeout=STREAM_IDLE_TIMEOUT_SECONDS, on_wait=None, parse=None, on_drained=None,
+                   max_queued=STREAM_QUEUE_MAX_CHUNKS):
+    """
+    Yield from `chunks`, enforcing the deadline and first-token/idle timeouts.
+
+    `chunks` is consumed on a daemon thread, which applies `parse` to each
+    chunk if given (a parse error ends the stream with that error) and reads
+    at most `max_queued` chunks ahead. `on_wait(seconds)` is called about
+    once a second while no chunk is arriving, and `on_wait(None)` when
+    chunks resume. `on_drained()` is called whenever every chunk received so
+    far has been yielded; if it returns a number of seconds, it is called
+    again once that much time passes without a new chunk. Close this
+    generator (or stop iterating it) to cancel the upstream stream.
+
+    The timeouts measure how long the endpoint went without sending, from
+    the moment the reader received the last chunk, and only apply once the
+    queue is empty: a consumer slower than the timeout never times out on
+    chunks that already arrived.
+    """
+    deadline = deadline or Deadline()
+    out = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+    reader = threading.Thread(target=_pump, args=(chunks, out, stop, parse), name="endpoint-stream", daemon=True)
+    reader.start()
+
+    first = True
+    waiting = False
+    last_chunk_at = time.monotonic()
+    # When on_drained asked to be called again if nothing arrives before then
+    recall_at = None
+    try:
+        while True:
+            deadline.check()
+            try:
+                batch = [out.get_nowait()]
+            except queue.Empty:
+                timeout = first_token_timeout if first else idle_timeout
+                waited = time.monotonic() - last_chunk_at
+                if waited >= timeout:
+                    raise StreamTimeoutError(
+                        f"No {'first' if first else 'new'} chunk from the endpoint within {timeout:.0f}s"
+                    )
+                wait = min(WAIT_POLL_SECONDS, timeout - waited, deadline.remaining())
+                if recall_at is not None:
+                    wait = max(0.0, min(wait, recall_at - time.monotonic()))
+                try:
+                    batch = [out.get(timeout=wait)]
+                except queue.Empty:
+                    if recall_at is not None and time.monotonic() >= recall_at:
+                        delay = on_drained()
+                        recall_at = None if delay is None else time.monotonic() + delay
+                    if on_wait is not None and time.monotonic() - last_chunk_at >= WAIT_POLL_SECONDS:
+                        waiting = True
+                        on_wait(time.monotonic() - last_chunk_at)
+                    continue
+            # Take everything else that is already waiting in one go
+            while len(batch) < STREAM_DRAIN_MAX_CHUNKS:
+                try:
+                    batch.append(out.get_nowait())
+                except queue.Empty:
+                    break
+            if waiting:
+                waiting = False
+                on_wait(None)
+            for chunk, error, received_at in batch:
+                if error is not None:
+                    raise error
+                if chunk is _END:
+                    return
+                first = False
+                last_chunk_at = received_at
+                yield chunk
+            if on_drained is not None and out.empty():
+                delay = on_drained()
+                recall_at = None if delay is None else time.monotonic() + delay
+    finally:
+        stop.set()
+        # Wake a reader blocked on a full queue so it can close the upstream
+        while True:
+            try:
+                out.get_nowait()
+            except queue.Empty:
+                break
+
+
+def call_with_deadline(fn, deadline=None, *args, on_done=None, **kwargs):
+    """
+    Call `fn(*args, **kwargs)` on a daemon thread and give up once the deadline passes.
+
+    A call that is given up on keeps running. `on_done()` is called once it
+    has actually finished, e.g. to give back an admission slot.
+    """
+    deadline = deadline or Deadline()
+    result = {}
+    done = threading.Event()
+
+    def run():
+        try:
+            result["value"] = fn(*args, **kwargs)
+        except BaseException as e:
+            result["error"] = e
+        finally:
+            done.set()
+            if on_done is not None:
+                on_done()
+
+    try:
+        threading.Thread(target=run, name="endpoint-call", daemon=True).start()
+    except BaseException:
+        if on_done is not None:
+            on_done()
+        raise
+    if not done.wait(deadline.remaining()):
+        raise DeadlineExceeded(f"Request did not finish within {deadline.seconds:.0f}s")
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
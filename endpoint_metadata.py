@@ -0,0 +1,120 @@
+"""
+Process-wide cache of serving endpoint metadata.
+
+Looking up an endpoint's task type and served entities is a control-plane
+round trip. The answer practically never changes while the app is running,
+so it is fetched once, shared by every Streamlit session, refreshed in a
+background thread before it goes stale, and can be invalidated explicitly
+(for example after redeploying the endpoint).
+
+Like messages.py, this module is imported rather than executed by the
+Streamlit script, so the cache survives reruns.
+"""
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from client_registry import get_workspace_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TASK_TYPE = "chat/completions"
+
+# How long a fetched entry may be served, and how often the background
+# thread refreshes known entries. Refreshing well inside the TTL means a
+# user turn never has to wait on a lookup.
+ENDPOINT_METADATA_TTL_SECONDS = float(os.getenv("ENDPOINT_METADATA_TTL_SECONDS", "600"))
+ENDPOINT_METADATA_REFRESH_SECONDS = float(
+    os.getenv("ENDPOINT_METADATA_REFRESH_SECONDS", str(ENDPOINT_METADATA_TTL_SECONDS / 2))
+)
+
+
+class EndpointMetadata(NamedTuple):
+    """The parts of a serving endpoint description the app cares about."""
+    task_type: str
+    served_entities: tuple
+    supports_feedback: bool
+
+
+def fetch_endpoint_metadata(endpoint_name: str) -> EndpointMetadata:
+    """Fetch endpoint metadata from the workspace (one control-plane call)."""
+    w = get_workspace_client()
+    ep = w.serving_endpoints.get(endpoint_name)
+    served_entities = ()
+    if ep.config and ep.config.served_entities:
+        served_entities = tuple(entity.name for entity in ep.config.served_entities)
+    return EndpointMetadata(
+        task_type=ep.task if ep.task else DEFAULT_TASK_TYPE,
+        served_entities=served_entities,
+        supports_feedback="feedback" in served_entities,
+    )
+
+
+class EndpointMetadataCache:
+    """
+    Thread-safe TTL cache of EndpointMetadata keyed by endpoint name.
+
+    Entries are refreshed by a daemon thread every `refresh_interval` seconds.
+    If a refresh fails the previous value keeps being served until it expires;
+    an expired or missing entry is fetched synchronously on lookup.
+    """
+
+    def __init__(self, fetch=fetch_endpoint_metadata,
+                 ttl=ENDPOINT_METADATA_TTL_SECONDS,
+                 refresh_interval=ENDPOINT_METADATA_REFRESH_SECONDS):
+        self._fetch = fetch
+        self._ttl = ttl
+        self._refresh_interval = refresh_interval
+        self._entries = {}  # endpoint name -> (EndpointMetadata, fetched_at)
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def get(self, endpoint_name: str) -> EndpointMetadata:
+        """Return cached metadata, fetching it if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(endpoint_name)
+        if entry is not None and time.monotonic() - entry[1] < self._ttl:
+            return entry[0]
+        return self.refresh(endpoint_name)
+
+    def refresh(self, endpoint_name: str) -> EndpointMetadata:
+        """Fetch metadata now and store it, replacing any cached entry."""
+        metadata = self._fetch(endpoint_name)
+        with self._lock:
+            self._entries[endpoint_name] = (metadata, time.monotonic())
+        self._ensure_refresher()
+        return metadata
+
+    def invalidate(self, endpoint_name: Optional[str] = None):
+        """Drop one endpoint's entry, or every entry if no name is given."""
+        with self._lock:
+            if endpoint_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(endpoint_name, None)
+
+    def _ensure_refresher(self):
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name="endpoint-metadata-refresh", daemon=True
+            )
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self._refresh_interval)
+            with self._lock:
+                endpoint_names = list(self._entries)
+            for endpoint_name in endpoint_names:
+                try:
+                    self.refresh(endpoint_name)
+                except Exception as e:
+                    logger.warning(f"Could not refresh metadata for endpoint {endpoint_name}: {e}")
+
+
+# Shared by every session in this process
+endpoint_metadata_cache = EndpointMetadataCache()
@@ -0,0 +1,128 @@
+"""
+Background, batched submission of thumbs up/down feedback.
+
+Submitting feedback is a POST to the endpoint's feedback proxy. Doing it in
+the widget's on_change callback makes every click wait on that request, so
+ratings are queued here and a worker thread sends them in batches (the proxy
+already takes a list of dataframe_records), retrying failures with
+exponential backoff. Pending ratings are flushed when the process exits.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "20"))
+FEEDBACK_FLUSH_INTERVAL_SECONDS = float(os.getenv("FEEDBACK_FLUSH_INTERVAL_SECONDS", "2"))
+FEEDBACK_MAX_RETRIES = int(os.getenv("FEEDBACK_MAX_RETRIES", "5"))
+FEEDBACK_RETRY_BASE_SECONDS = 0.5
+FEEDBACK_RETRY_MAX_SECONDS = 30.0
+
+
+def _submit_batch(endpoint, records):
+    from model_serving_utils import submit_feedback_batch
+    submit_feedback_batch(endpoint, records)
+
+
+def _build_record(request_id, rating):
+    from model_serving_utils import feedback_record
+    return feedback_record(request_id, rating)
+
+
+class FeedbackQueue:
+    """
+    Queue feedback and submit it from a worker thread.
+
+    A batch is sent once `batch_size` ratings are waiting or `flush_interval`
+    seconds after the first one arrived. Records are grouped per endpoint,
+    and a failed batch is retried up to `max_retries` times with jittered
+    exponential backoff before it is dropped and logged.
+    """
+
+    def __init__(self, submit_batch=_submit_batch, batch_size=FEEDBACK_BATCH_SIZE,
+                 flush_interval=FEEDBACK_FLUSH_INTERVAL_SECONDS, max_retries=FEEDBACK_MAX_RETRIES):
+        self._submit_batch = submit_batch
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def put(self, endpoint, request_id, rating):
+        """Queue one rating; returns immediately."""
+        self._queue.put((endpoint, _build_record(request_id, rating)))
+        self._ensure_worker()
+
+    def close(self, timeout=10.0):
+        """Stop accepting work and wait for queued ratings to be sent."""
+        self._stopping.set()
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            worker.join(timeout)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="feedback-queue", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._send(batch)
+
+    def _next_batch(self):
+        """Collect up to batch_size items, waiting at most flush_interval after the first."""
+        try:
+            batch = [self._queue.get(timeout=self._flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                # Drain without waiting once shutting down
+                remaining = 0
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        records_by_endpoint = defaultdict(list)
+        for endpoint, record in batch:
+            records_by_endpoint[endpoint].append(record)
+        for endpoint, records in records_by_endpoint.items():
+            for attempt in range(self._max_retries + 1):
+                try:
+                    self._submit_batch(endpoint, records)
+                    break
+                except Exception as e:
+                    if attempt == self._max_retries:
+                        logger.error(f"Dropping {len(records)} feedback records for {endpoint}: {e}")
+                        break
+                    delay = min(FEEDBACK_RETRY_MAX_SECONDS, FEEDBACK_RETRY_BASE_SECONDS * 2 ** attempt)
+                    delay *= random.uniform(0.5, 1.0)
+                    logger.warning(f"Feedback submission failed ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+
+
+# Shared by every session in this process
+feedback_queue = FeedbackQueue()
+atexit.register(feedback_queue.close)
+
+
+def enqueue_feedback(endpoint, request_id, rating):
+    """Queue feedback for background submission."""
+    feedback_queue.put(endpoint, request_id, rating)
@@ -0,0 +1,203 @@
+"""
+Load test the app against the mock serving endpoint.
+
+Simulated users run concurrently, each in its own headless Streamlit
+session (streamlit.testing AppTest) executing the real streamlit_app.py, so
+turns go through the real handlers, stream pipeline and renderers. Only the
+Databricks clients are replaced, by mock_serving.py. At the end the script
+reports p50/p95/p99 turn latency, the app's time-to-first-token histogram
+and throughput.
+
+    python loadtest.py --task-type agent/v1/responses --sessions 20 --turns 3 --tool-calls 1
+
+Response caches are disabled unless --cache is passed, so every turn
+reaches the endpoint.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BASE_DIR, "streamlit_app.py")
+
+TASK_TYPES = ("chat/completions", "agent/v2/chat", "agent/v1/responses")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--task-type", choices=TASK_TYPES, default="chat/completions")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=3, help="questions asked per user")
+    parser.add_argument("--think-time", type=float, default=0.5, help="seconds between a user's turns")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="seconds over which users start")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.5)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--tool-calls", type=int, default=0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--no-streaming", action="store_true", help="endpoint rejects streaming requests")
+    parser.add_argument("--cache", action="store_true", help="keep the response and semantic caches on")
+    parser.add_argument("--same-question", action="store_true",
+                        help="every user asks the same questions (exercises single-flight coalescing)")
+    parser.add_argument("--timeout", type=float, default=180.0, help="per-turn script timeout")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args()
+
+
+def _configure_environment(args):
+    """Point the app at the mock endpoint; must run before the app's modules are imported."""
+    os.environ.setdefault("SERVING_ENDPOINT", "mock-endpoint")
+    os.environ.setdefault("DATABRICKS_HOST", "https://mock.invalid")
+    os.environ.setdefault("DATABRICKS_TOKEN", "mock-token")
+    os.environ.setdefault("METRICS_LOG_INTERVAL_SECONDS", "0")
+    if not args.cache:
+        os.environ["RESPONSE_CACHE_PATH"] = ""
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+
+def _allow_concurrent_app_tests():
+    """
+    Let several AppTests run at once in this process.
+
+    AppTest installs a mock Streamlit runtime for the duration of each run and
+    clears it afterwards, which breaks any other session still running. Here
+    one shared mock runtime is installed for the whole load test instead.
+    """
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    # AppTest patches this option per run; keep it set between overlapping runs
+    config.set_option("global.appTest", True)
+
+
+def _run_session(session_index, args, results, lock):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    app.run()
+    for turn_index in range(args.turns):
+        # Distinct questions so turns can't be answered from one another, unless asked otherwise
+        asker = "a user" if args.same_question else f"user {session_index}"
+        question = f"Question {turn_index} from {asker}: which forage suits dry seasons?"
+        started = time.monotonic()
+        error = None
+        try:
+            app.chat_input[0].set_value(question).run()
+            if app.exception:
+                error = app.exception[0].value
+            elif app.error:
+                error = app.error[0].value
+        except Exception as e:
+            error = str(e)
+        elapsed = time.monotonic() - started
+        with lock:
+            results.append({"session": session_index, "turn": turn_index, "seconds": elapsed, "error": error})
+        time.sleep(args.think_time)
+
+
+def main():
+    args = _parse_args()
+    _configure_environment(args)
+    logging.basicConfig(level=logging.WARNING)
+
+    from mock_serving import MockEndpointConfig, install_mock_clients
+    from metrics import metrics
+
+    install_mock_clients(MockEndpointConfig(
+        task_type=args.task_type,
+        tokens_per_second=args.tokens_per_second,
+        first_token_delay=args.first_token_delay,
+        answer_tokens=args.answer_tokens,
+        tool_calls=args.tool_calls,
+        disconnect_rate=args.disconnect_rate,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        supports_streaming=not args.no_streaming,
+        seed=args.seed,
+    ))
+
+    _allow_concurrent_app_tests()
+    results = []
+    lock = threading.Lock()
+    threads = []
+    started = time.monotonic()
+    for i in range(args.sessions):
+        thread = threading.Thread(target=_run_session, args=(i, args, results, lock), name=f"session-{i}")
+        thread.start()
+        threads.append(thread)
+        time.sleep(args.ramp_up / max(1, args.sessions))
+    for thread in threads:
+        thread.join()
+    wall_time = time.monotonic() - started
+
+    latencies = [r["seconds"] for r in results if r["error"] is None]
+    errors = [r for r in results if r["error"] is not None]
+    ttft = next((s for s in metrics.snapshot()
+                 if s["metric"] == "chatbot_time_to_first_token_seconds" and s.get("task_type") == args.task_type),
+                {})
+    admission_wait = next((s for s in metrics.snapshot() if s["metric"] == "chatbot_admission_wait_seconds"), {})
+    joins = sum(s["value"] for s in metrics.snapshot()
+                if s["metric"] == "chatbot_single_flight_joins_total" and s.get("task_type") == args.task_type)
+    outcomes = {s["outcome"]: s["value"] for s in metrics.snapshot()
+                if s["metric"] == "chatbot_turns_total" and s.get("task_type") == args.task_type}
+    report = {
+        "task_type": args.task_type,
+        "sessions": args.sessions,
+        "turns": len(results),
+        "errors": len(errors),
+        # complete / partial / failed / cached, as recorded by the app
+        "outcomes": outcomes,
+        # Turns that followed another session's identical in-flight stream
+        "single_flight_joins": joins,
+        "wall_seconds": round(wall_time, 3),
+        "turn_seconds": {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)},
+        # Estimated from the app's histogram buckets
+        "time_to_first_token_seconds": {key: ttft.get(key) for key in ("p50", "p95", "p99")},
+        # Time spent queued for an endpoint slot (see admission.py)
+        "admission_wait_seconds": {key: admission_wait.get(key) for key in ("p50", "p95", "p99")},
+        "turns_per_second": round(len(latencies) / wall_time, 3) if wall_time else None,
+        "tokens_per_second": round(len(latencies) * args.answer_tokens / wall_time, 1) if wall_time else None,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['turns']} turns from {args.sessions} sessions ({args.task_type}) in {wall_time:.1f}s, "
+          f"{len(errors)} errors")
+    print(f"  outcomes: {', '.join(f'{key}={value:g}' for key, value in sorted(outcomes.items()))}, "
+          f"single-flight joins={joins:g}")
+    for name in ("turn_seconds", "time_to_first_token_seconds", "admission_wait_seconds"):
+        values = ", ".join(f"{key}={value:.3f}s" if value is not None else f"{key}=n/a"
+                           for key, value in report[name].items())
+        print(f"  {name}: {values}")
+    print(f"  throughput: {report['turns_per_second']} turns/s, {report['tokens_per_second']} tokens/s")
+    for error in errors[:5]:
+        print(f"  error in session {error['session']} turn {error['turn']}: {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
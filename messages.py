@@ -6,7 +6,22 @@ By keeping them in a separate module, they remain stable across
 Streamlit app reruns, avoiding isinstance comparison issues.
 """
 import streamlit as st
+import ast
+import os
+import uuid
 from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+from static_assets import small_image
+
+# Number of turns rendered at first, and added per "Show earlier messages" click
+HISTORY_PAGE_TURNS = int(os.getenv("HISTORY_PAGE_TURNS", "10"))
+
+INCOMPLETE_ANSWER_NOTICE = "⚠️ The answer was interrupted and may be incomplete."
+
+# Avatars are shown at 2rem; 64px variants stay sharp on high-density screens
+USER_AVATAR = small_image("user.png", 64)
+ASSISTANT_AVATAR = small_image("grass.png", 64)
 
 
 class Message(ABC):
@@ -23,6 +38,25 @@ class Message(ABC):
         """Render the message in the Streamlit app."""
         pass
 
+    def to_responses_input(self):
+        """
+        Convert this message into ResponsesAgent input items.
+
+        The result is computed once and kept on the message, including the ids
+        assigned to assistant messages, so the same history serializes
+        identically on every turn and only new messages need converting.
+        """
+        cached = getattr(self, "_responses_input", None)
+        if cached is None:
+            from model_serving_utils import _convert_message_to_responses_format
+            cached = [
+                item
+                for msg in self.to_input_messages()
+                for item in _convert_message_to_responses_format(msg, default_id=str(uuid.uuid4()))
+            ]
+            self._responses_input = cached
+        return cached
+
 
 class UserMessage(Message):
     def __init__(self, content):
@@ -36,36 +70,51 @@ class UserMessage(Message):
         }]
 
     def render(self, _):
-        with st.chat_message("user", avatar="public/user.png"):
+        with st.chat_message("user", avatar=USER_AVATAR):
             st.markdown(self.content)
 
 
 class AssistantResponse(Message):
-    def __init__(self, messages, request_id):
+    def __init__(self, messages, request_id, complete=True):
         super().__init__()
         self.messages = messages
         # Request ID tracked to enable submitting feedback on assistant responses via the feedback endpoint
         self.request_id = request_id
+        # False when the stream failed part way and only the partial answer was kept
+        self.complete = complete
+        # Parsed once here so reruns only walk the precomputed parts
+        self.display_parts = [part for msg in messages for part in to_display_parts(msg)]
 
     def to_input_messages(self):
         return self.messages
 
     def render(self, idx):
-        with st.chat_message("assistant", avatar="public/grass.png"):
-            for msg in self.messages:
-                render_message(msg)
+        with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
+            render_display_parts(self.display_parts)
+            if not self.complete:
+                st.caption(INCOMPLETE_ANSWER_NOTICE)
 
             if self.request_id is not None:
                 render_assistant_message_feedback(idx, self.request_id)
 
 
-def render_message(msg):
-    """Render a single message."""
+class DisplayPart(NamedTuple):
+    """
+    One precomputed piece of a message's on-screen representation.
+
+    kind is "markdown" (answer text), "tool_output" (shown as a code block)
+    or "hidden" (raw documents and other content kept out of the UI).
+    """
+    kind: str
+    text: str
+
+
+def to_display_parts(msg):
+    """Normalize a message into the list of DisplayParts used to render it."""
+    parts = []
     if msg["role"] == "assistant":
-        import ast
         content = msg.get("content")
         if content:
-            rendered = False
             # Try to parse stringified list/dict and extract only final answer(s)
             if isinstance(content, str) and (content.strip().startswith("[") or content.strip().startswith("{")):
                 try:
@@ -74,39 +123,83 @@ def render_message(msg):
                     if isinstance(parsed, list):
                         for part in parsed:
                             if isinstance(part, dict) and part.get("type") in ("text", "output_text") and "text" in part:
-                                st.markdown(part["text"])
-                                rendered = True
+                                parts.append(DisplayPart("markdown", part["text"]))
                     elif isinstance(parsed, dict) and parsed.get("type") in ("text", "output_text") and "text" in parsed:
-                        st.markdown(parsed["text"])
-                        rendered = True
+                        parts.append(DisplayPart("markdown", parsed["text"]))
                 except Exception:
                     pass
-            if not rendered and isinstance(content, str):
+            if not parts and isinstance(content, str):
                 # Only display if it doesn't look like a tool response or raw doc
-                if not (content.strip().startswith("[Document(") or content.strip().startswith("[{'chunk_id'")):
-                    st.markdown(content)
-        # Only render tool calls if you want to show them to the user (optional)
-        # If you want to skip tool calls, comment out or remove the following block:
-        # if "tool_calls" in msg and msg["tool_calls"]:
-        #     for call in msg["tool_calls"]:
-        #         fn_name = call["function"]["name"]
-        #         args = call["function"]["arguments"]
-        #         st.markdown(f"🛠️ Calling **`{fn_name}`** with:\n```json\n{args}\n```")
+                if content.strip().startswith("[Document(") or content.strip().startswith("[{'chunk_id'"):
+                    parts.append(DisplayPart("hidden", content))
+                else:
+                    parts.append(DisplayPart("markdown", content))
+        # Tool calls are not shown to the user. To show them, add a part here, e.g.
+        # DisplayPart("markdown", f"🛠️ Calling **`{fn_name}`** with:\n```json\n{args}\n```")
+        # for each call in msg.get("tool_calls") or [].
     elif msg["role"] == "tool":
-        st.markdown("🧰 Tool Response:")
-        st.code(msg["content"], language="json")
+        parts.append(DisplayPart("tool_output", msg["content"]))
+    return parts
+
+
+def render_display_parts(parts):
+    """Render precomputed DisplayParts."""
+    for part in parts:
+        if part.kind == "markdown":
+            st.markdown(part.text)
+        elif part.kind == "tool_output":
+            st.markdown("🧰 Tool Response:")
+            st.code(part.text, language="json")
+
+
+def render_message(msg):
+    """Render a single message."""
+    render_display_parts(to_display_parts(msg))
+
+
+def _show_earlier_turns():
+    st.session_state.history_visible_turns += HISTORY_PAGE_TURNS
+
+
+def render_history(history):
+    """
+    Render the most recent turns of the chat history.
+
+    Only the last `history_visible_turns` turns (a user message and the
+    responses to it) are emitted, feedback widgets included; older turns are
+    paged in with a button so long sessions keep reruns cheap.
+    """
+    if "history_visible_turns" not in st.session_state:
+        st.session_state.history_visible_turns = HISTORY_PAGE_TURNS
+    visible_turns = st.session_state.history_visible_turns
+
+    turn_starts = [i for i, element in enumerate(history) if isinstance(element, UserMessage)]
+    start = 0
+    if len(turn_starts) > visible_turns:
+        start = turn_starts[-visible_turns]
+        hidden_turns = len(turn_starts) - visible_turns
+        st.button(
+            f"Show earlier messages ({hidden_turns} older {'question' if hidden_turns == 1 else 'questions'})",
+            key="show_earlier_messages",
+            on_click=_show_earlier_turns,
+        )
+
+    for i in range(start, len(history)):
+        # Keep absolute indices so feedback widget keys stay stable
+        history[i].render(i)
 
 
 @st.fragment
 def render_assistant_message_feedback(i, request_id):
     """Render feedback UI for assistant messages."""
-    from model_serving_utils import submit_feedback
-    import os
+    from feedback_queue import enqueue_feedback
+    from app_config import load_config
     
     def save_feedback(index):
-        serving_endpoint = os.getenv('SERVING_ENDPOINT')
+        serving_endpoint = load_config().serving_endpoint
         if serving_endpoint:
-            submit_feedback(
+            # Queued and sent in the background so the click returns right away
+            enqueue_feedback(
                 endpoint=serving_endpoint,
                 request_id=request_id,
                 rating=st.session_state[f"feedback_{index}"]
@@ -0,0 +1,266 @@
+"""
+Latency and throughput metrics for model turns.
+
+Each turn records where its time went (endpoint metadata lookup, time to
+first chunk and first rendered token, streaming rate, total duration),
+payload sizes, retries and non-streaming fallbacks, tagged by task type.
+Values go into fixed-bucket histograms so tail latencies stay visible.
+
+Metrics are exposed in the Prometheus text format on
+http://0.0.0.0:$METRICS_PORT/metrics when METRICS_PORT is set, and logged
+as one JSON line per series (with p50/p95/p99 estimates) every
+METRICS_LOG_INTERVAL_SECONDS (0 disables the log lines).
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+METRICS_LOG_INTERVAL_SECONDS = float(os.getenv("METRICS_LOG_INTERVAL_SECONDS", "300"))
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0)
+
+_BUCKETS = {
+    "chatbot_metadata_lookup_seconds": LATENCY_BUCKETS,
+    "chatbot_endpoint_call_seconds": LATENCY_BUCKETS,
+    "chatbot_admission_wait_seconds": LATENCY_BUCKETS,
+    "chatbot_time_to_first_chunk_seconds": LATENCY_BUCKETS,
+    "chatbot_time_to_first_token_seconds": LATENCY_BUCKETS,
+    "chatbot_turn_duration_seconds": LATENCY_BUCKETS,
+    "chatbot_stream_chunks_per_second": RATE_BUCKETS,
+    "chatbot_stream_tokens_per_second": RATE_BUCKETS,
+    "chatbot_request_payload_bytes": BYTES_BUCKETS,
+    "chatbot_response_payload_bytes": BYTES_BUCKETS,
+    "chatbot_semantic_cache_best_similarity": SIMILARITY_BUCKETS,
+}
+
+
+class Histogram:
+    """Cumulative fixed-bucket histogram, as in the Prometheus data model."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating linearly inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    # Beyond the last bound all we know is the lower edge
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def _format_bounds(buckets):
+    return [f"{bound:g}" for bound in buckets] + ["+Inf"]
+
+
+class MetricsRegistry:
+    """Process-wide histograms and counters keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}  # (name, labels) -> float
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(_BUCKETS.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render_prometheus(self):
+        """All series in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, bucket_count in zip(_format_bounds(histogram.buckets), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """One dict per series with count, sum and p50/p95/p99 (histograms) or value (counters)."""
+        series = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                series.append({
+                    "metric": name,
+                    **dict(labels),
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 4),
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                })
+            for (name, labels), value in sorted(self._counters.items()):
+                series.append({"metric": name, **dict(labels), "value": value})
+        return series
+
+
+# Shared by every session in this process
+metrics = MetricsRegistry()
+
+
+class TurnMetrics:
+    """
+    Timings of one model turn, recorded into `metrics` tagged by task type.
+
+    Call chunk() for every chunk received, content() for every text delta
+    handed to the renderer (rendered() for whole items), retry()/fallback()
+    when those happen and finish() once at the end.
+    """
+
+    def __init__(self, task_type, registry=metrics):
+        self.task_type = task_type
+        self._registry = registry
+        self._started = time.monotonic()
+        self._first_chunk_at = None
+        self._first_token_at = None
+        self.chunks = 0
+        self.tokens = 0
+        self.response_bytes = 0
+        self._finished = False
+
+    def chunk(self):
+        if self._first_chunk_at is None:
+            self._first_chunk_at = time.monotonic()
+            self._registry.observe("chatbot_time_to_first_chunk_seconds",
+                                   self._first_chunk_at - self._started, task_type=self.task_type)
+        self.chunks += 1
+
+    def rendered(self):
+        """Record that answer content was handed to the renderer."""
+        if self._first_token_at is None:
+            self._first_token_at = time.monotonic()
+            self._registry.observe("chatbot_time_to_first_token_seconds",
+                                   self._first_token_at - self._started, task_type=self.task_type)
+
+    def content(self, nbytes):
+        """Record a rendered content delta; streamed deltas are roughly one token each."""
+        self.rendered()
+        self.tokens += 1
+        self.response_bytes += nbytes
+
+    def retry(self):
+        self._registry.increment("chatbot_stream_retries_total", task_type=self.task_type)
+
+    def fallback(self):
+        self._registry.increment("chatbot_nonstreaming_fallbacks_total", task_type=self.task_type)
+
+    def finish(self, outcome):
+        """Record the turn's totals. outcome is e.g. "complete", "partial", "failed", "cached"."""
+        if self._finished:
+            return
+        self._finished = True
+        now = time.monotonic()
+        self._registry.observe("chatbot_turn_duration_seconds", now - self._started,
+                               task_type=self.task_type, outcome=outcome)
+        self._registry.increment("chatbot_turns_total", task_type=self.task_type, outcome=outcome)
+        if self._first_chunk_at is not None and now > self._first_chunk_at:
+            streaming_time = now - self._first_chunk_at
+            self._registry.observe("chatbot_stream_chunks_per_second", self.chunks / streaming_time,
+                                   task_type=self.task_type)
+            if self.tokens:
+                self._registry.observe("chatbot_stream_tokens_per_second", self.tokens / streaming_time,
+                                       task_type=self.task_type)
+        if self.response_bytes:
+            self._registry.observe("chatbot_response_payload_bytes", self.response_bytes,
+                                   task_type=self.task_type)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise be written to stderr
+        pass
+
+
+def _log_periodically(interval):
+    while True:
+        time.sleep(interval)
+        for series in metrics.snapshot():
+            logger.info(json.dumps(series))
+
+
+_exporters_lock = threading.Lock()
+_exporters_started = False
+
+
+def start_metrics_exporters(port=METRICS_PORT, log_interval=METRICS_LOG_INTERVAL_SECONDS):
+    """Start the /metrics server and the periodic log lines, once per process."""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if port:
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as e:
+            logger.warning(f"Could not start metrics server on port {port}: {e}")
+        else:
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+            logger.info(f"Serving metrics on port {port}")
+    if log_interval > 0:
+        threading.Thread(target=_log_periodically, args=(log_interval,), name="metrics-log", daemon=True).start()
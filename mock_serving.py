@@ -0,0 +1,195 @@
+"""
+Local stand-in for a Databricks serving endpoint.
+
+MockDeployClient emulates the MLflow deployments client's predict() and
+predict_stream() for the three endpoint formats the app supports
+(chat/completions, agent/v2/chat and agent/v1/responses), and
+MockWorkspaceClient answers the endpoint metadata lookup and feedback calls.
+Token rate, time to first token, tool calls and injected failures are set
+through MockEndpointConfig, so the app can be benchmarked and load tested
+without a live endpoint:
+
+    from mock_serving import MockEndpointConfig, install_mock_clients
+    install_mock_clients(MockEndpointConfig(task_type="agent/v1/responses", tool_calls=1))
+
+See loadtest.py for a load generator built on it.
+"""
+import json
+import random
+import time
+import uuid
+from types import SimpleNamespace
+from typing import NamedTuple
+
+_WORDS = (
+    "Brachiaria Panicum Stylosanthes forage legumes grasses pasture dry season rainfall "
+    "establishment grazing yield protein nitrogen fixation soil fertility seed rate cattle "
+    "intake digestibility tolerance drought acid soils cutting interval regrowth mixture"
+).split()
+
+
+class MockEndpointConfig(NamedTuple):
+    """Behaviour of the mock endpoint."""
+    task_type: str = "chat/completions"
+    # Streaming speed and time to first token, in tokens per second and seconds
+    tokens_per_second: float = 50.0
+    first_token_delay: float = 0.5
+    answer_tokens: int = 120
+    # Tool call rounds before the answer (agent formats only)
+    tool_calls: int = 0
+    tool_latency: float = 0.3
+    # Probability that a stream drops with a connection error part way through
+    disconnect_rate: float = 0.0
+    # Probability that a request is rejected up front with `error_status`
+    error_rate: float = 0.0
+    error_status: int = 503
+    supports_streaming: bool = True
+    supports_feedback: bool = True
+    seed: int = None
+
+
+class MockHTTPError(Exception):
+    """An HTTP error response, shaped like requests.HTTPError for retry_policy."""
+
+    def __init__(self, status_code):
+        super().__init__(f"Mock endpoint returned HTTP status {status_code}")
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+def _answer_tokens(count, rng):
+    return [("" if i == 0 else " ") + rng.choice(_WORDS) for i in range(count)]
+
+
+class MockDeployClient:
+    """Fake MLflow deployments client for one mock endpoint."""
+
+    def __init__(self, config=MockEndpointConfig()):
+        self.config = config
+        self._rng = random.Random(config.seed)
+
+    def predict(self, endpoint, inputs):
+        self._maybe_reject()
+        time.sleep(self.config.first_token_delay + self.config.tool_calls * self.config.tool_latency
+                   + self.config.answer_tokens / self.config.tokens_per_second)
+        tokens = _answer_tokens(self.config.answer_tokens, self._rng)
+        events = list(self._stream_events(tokens, delay=False))
+        request_id = str(uuid.uuid4())
+        output = {"databricks_output": {"databricks_request_id": request_id}}
+        if self.config.task_type == "agent/v1/responses":
+            output["output"] = [event["item"] for event in events if event.get("type") == "response.output_item.done"]
+        elif self.config.task_type == "agent/v2/chat":
+            messages = {}
+            for event in events:
+                delta = event["delta"]
+                message = messages.setdefault(delta["id"], dict(delta, content=""))
+                message["content"] += delta.get("content") or ""
+            output["messages"] = list(messages.values())
+        else:
+            output["choices"] = [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}}]
+        return output
+
+    def predict_stream(self, endpoint, inputs):
+        if not self.config.supports_streaming:
+            raise NotImplementedError("Streaming is not supported by this endpoint")
+        self._maybe_reject()
+        tokens = _answer_tokens(self.config.answer_tokens, self._rng)
+        # Decide up front where (if anywhere) this stream drops
+        drop_at = None
+        if self._rng.random() < self.config.disconnect_rate:
+            drop_at = self._rng.randrange(1, max(2, self.config.answer_tokens))
+
+        time.sleep(self.config.first_token_delay)
+        request_id = str(uuid.uuid4())
+        for i, event in enumerate(self._stream_events(tokens, delay=True)):
+            if i == drop_at:
+                raise ConnectionError("Mock endpoint closed the connection mid-stream")
+            event["databricks_output"] = {"databricks_request_id": request_id}
+            yield event
+
+    def _maybe_reject(self):
+        if self._rng.random() < self.config.error_rate:
+            raise MockHTTPError(self.config.error_status)
+
+    def _stream_events(self, tokens, delay):
+        """Raw chunks in the endpoint's format; sleeps between tokens if `delay`."""
+        task_type = self.config.task_type
+        interval = 1.0 / self.config.tokens_per_second if delay else 0
+
+        def tick(seconds):
+            if delay and seconds:
+                time.sleep(seconds)
+
+        tool_rounds = self.config.tool_calls if task_type != "chat/completions" else 0
+        for round_index in range(tool_rounds):
+            call_id = f"call_{uuid.uuid4().hex[:12]}"
+            arguments = json.dumps({"query": "".join(tokens[:3]), "round": round_index})
+            output = json.dumps([{"chunk_id": i, "text": f"Document {i} about {self._rng.choice(_WORDS)}"}
+                                 for i in range(3)])
+            if task_type == "agent/v1/responses":
+                yield {"type": "response.output_item.done", "item": {
+                    "type": "function_call", "id": str(uuid.uuid4()), "call_id": call_id,
+                    "name": "search_forages", "arguments": arguments,
+                }}
+                tick(self.config.tool_latency)
+                yield {"type": "response.output_item.done", "item": {
+                    "type": "function_call_output", "call_id": call_id, "output": output,
+                }}
+            else:
+                yield {"delta": {
+                    "role": "assistant", "content": "", "id": str(uuid.uuid4()),
+                    "tool_calls": [{"id": call_id, "type": "function",
+                                    "function": {"name": "search_forages", "arguments": arguments}}],
+                }}
+                tick(self.config.tool_latency)
+                yield {"delta": {"role": "tool", "content": output, "id": str(uuid.uuid4()),
+                                 "name": "search_forages", "tool_call_id": call_id}}
+
+        message_id = str(uuid.uuid4())
+        for token in tokens:
+            tick(interval)
+            if task_type == "agent/v1/responses":
+                yield {"type": "response.output_text.delta", "item_id": message_id, "delta": token}
+            elif task_type == "agent/v2/chat":
+                yield {"delta": {"role": "assistant", "content": token, "id": message_id}}
+            else:
+                yield {"object": "chat.completion.chunk",
+                       "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}}]}
+        if task_type == "agent/v1/responses":
+            yield {"type": "response.output_item.done", "item": {
+                "type": "message", "id": message_id, "role": "assistant", "status": "completed",
+                "content": [{"type": "output_text", "text": "".join(tokens), "annotations": []}],
+            }}
+
+
+def synthetic_trace(config=MockEndpointConfig()):
+    """The raw chunks one predict_stream call would yield, generated without the delays."""
+    client = MockDeployClient(config)
+    tokens = _answer_tokens(config.answer_tokens, client._rng)
+    return list(client._stream_events(tokens, delay=False))
+
+
+class MockWorkspaceClient:
+    """Fake WorkspaceClient covering the endpoint lookup and feedback calls the app makes."""
+
+    def __init__(self, config=MockEndpointConfig()):
+        self.config = config
+        served_entities = [SimpleNamespace(name="agent")]
+        if config.supports_feedback:
+            served_entities.append(SimpleNamespace(name="feedback"))
+        endpoint = SimpleNamespace(
+            task=config.task_type,
+            config=SimpleNamespace(served_entities=served_entities),
+        )
+        self.serving_endpoints = SimpleNamespace(get=lambda name: endpoint)
+        self.feedback_requests = []
+        self.api_client = SimpleNamespace(do=lambda **request: self.feedback_requests.append(request))
+
+
+def install_mock_clients(config=MockEndpointConfig()):
+    """Make the app's client registry hand out mock clients, and forget cached endpoint metadata."""
+    from client_registry import client_registry
+    from endpoint_metadata import endpoint_metadata_cache
+
+    client_registry.register("workspace", lambda: MockWorkspaceClient(config))
+    client_registry.register("deploy", lambda: MockDeployClient(config))
+    endpoint_metadata_cache.invalidate()
@@ -1,6 +1,12 @@
-from mlflow.deployments import get_deploy_client
-from databricks.sdk import WorkspaceClient
+from client_registry import get_deploy_client, get_workspace_client
+from endpoint_metadata import DEFAULT_TASK_TYPE, endpoint_metadata_cache
+from deadlines import call_with_deadline, guarded_stream
+from admission import admission_controller
+from response_cache import conversation_key
+from single_flight import SINGLE_FLIGHT_ENABLED, single_flight
+from metrics import metrics
 import json
+import time
 import uuid
 
 import logging
@@ -11,71 +17,165 @@ logging.basicConfig(
     level=logging.DEBUG
 )
 
+def get_endpoint_metadata(endpoint_name: str):
+    """Get the cached task type, served entities and feedback support of an endpoint."""
+    return endpoint_metadata_cache.get(endpoint_name)
+
+def invalidate_endpoint_metadata(endpoint_name: str = None):
+    """Forget cached endpoint metadata, e.g. after the endpoint was redeployed."""
+    endpoint_metadata_cache.invalidate(endpoint_name)
+
 def _get_endpoint_task_type(endpoint_name: str) -> str:
     """Get the task type of a serving endpoint."""
+    started = time.monotonic()
     try:
-        w = WorkspaceClient()
-        ep = w.serving_endpoints.get(endpoint_name)
-        return ep.task if ep.task else "chat/completions"
+        task_type = get_endpoint_metadata(endpoint_name).task_type
     except Exception:
-        return "chat/completions"
+        task_type = DEFAULT_TASK_TYPE
+    metrics.observe("chatbot_metadata_lookup_seconds", time.monotonic() - started, task_type=task_type)
+    return task_type
+
+def _record_request_size(task_type, messages):
+    try:
+        size = len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+    except (TypeError, ValueError):
+        return
+    metrics.observe("chatbot_request_payload_bytes", size, task_type=task_type)
 
 def _convert_to_responses_format(messages):
-    """Convert chat messages to ResponsesAgent API format."""
+    """
+    Convert chat messages to ResponsesAgent API format.
+
+    Items that are already in Responses format (they carry a "type", e.g.
+    the cached output of Message.to_responses_input()) are passed through,
+    so only messages added since the last turn are converted.
+    """
     input_messages = []
     for msg in messages:
-        if msg["role"] == "user":
-            input_messages.append({"role": "user", "content": msg["content"]})
-        elif msg["role"] == "assistant":
-            # Handle assistant messages with tool calls
-            if msg.get("tool_calls"):
-                # Add function calls
-                for tool_call in msg["tool_calls"]:
-                    input_messages.append({
-                        "type": "function_call",
-                        "id": tool_call["id"],
-                        "call_id": tool_call["id"],
-                        "name": tool_call["function"]["name"],
-                        "arguments": tool_call["function"]["arguments"]
-                    })
-                # Add assistant message if it has content
-                if msg.get("content"):
-                    input_messages.append({
-                        "type": "message",
-                        "id": msg.get("id", str(uuid.uuid4())),
-                        "content": [{"type": "output_text", "text": msg["content"]}],
-                        "role": "assistant"
-                    })
-            else:
-                # Regular assistant message
+        if "type" in msg:
+            input_messages.append(msg)
+        else:
+            input_messages.extend(_convert_message_to_responses_format(msg))
+    return input_messages
+
+def _convert_message_to_responses_format(msg, default_id=None):
+    """
+    Convert a single chat message to a list of ResponsesAgent input items.
+
+    Assistant messages without an id get `default_id`, or a random one if
+    none is given; pass a stable id to keep repeated conversions identical.
+    """
+    input_messages = []
+    if msg["role"] in ("user", "system"):
+        input_messages.append({"role": msg["role"], "content": msg["content"]})
+    elif msg["role"] == "assistant":
+        message_id = msg.get("id") or default_id or str(uuid.uuid4())
+        # Handle assistant messages with tool calls
+        if msg.get("tool_calls"):
+            # Add function calls
+            for tool_call in msg["tool_calls"]:
+                input_messages.append({
+                    "type": "function_call",
+                    "id": tool_call["id"],
+                    "call_id": tool_call["id"],
+                    "name": tool_call["function"]["name"],
+                    "arguments": tool_call["function"]["arguments"]
+                })
+            # Add assistant message if it has content
+            if msg.get("content"):
                 input_messages.append({
                     "type": "message",
-                    "id": msg.get("id", str(uuid.uuid4())),
+                    "id": message_id,
                     "content": [{"type": "output_text", "text": msg["content"]}],
                     "role": "assistant"
                 })
-        elif msg["role"] == "tool":
+        else:
+            # Regular assistant message
             input_messages.append({
-                "type": "function_call_output",
-                "call_id": msg.get("tool_call_id"),
-                "output": msg["content"]
+                "type": "message",
+                "id": message_id,
+                "content": [{"type": "output_text", "text": msg["content"]}],
+                "role": "assistant"
             })
+    elif msg["role"] == "tool":
+        input_messages.append({
+            "type": "function_call_output",
+            "call_id": msg.get("tool_call_id"),
+            "output": msg["content"]
+        })
     return input_messages
 
 def _throw_unexpected_endpoint_format():
     raise Exception("This app can only run against ChatModel, ChatAgent, or ResponsesAgent endpoints")
 
-def query_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
-    task_type = _get_endpoint_task_type(endpoint_name)
+def query_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool, task_type: str = None,
+                          deadline=None, on_wait=None, session_id=None, on_queue=None, parse=None,
+                          on_drained=None):
+    """
+    Stream an endpoint's response within `deadline` (a deadlines.Deadline),
+    with first-token and idle timeouts. Close the returned generator to
+    cancel the upstream request.
+
+    Chunks are read, and passed through `parse` if given, on a reader thread
+    ahead of the caller; `on_drained()` is called whenever the caller has
+    caught up with them, and again after the delay it returns, if any (see
+    deadlines.guarded_stream).
+
+    The stream first waits for one of the endpoint's admission slots (see
+    admission.py) and holds it until it ends; `on_queue` reports the queue
+    position and estimated wait meanwhile. A request identical to one that
+    is already streaming, or still queued for its slot, follows that stream
+    instead (see single_flight.py).
+    """
+    if task_type is None:
+        task_type = _get_endpoint_task_type(endpoint_name)
+    _record_request_size(task_type, messages)
     
     if task_type == "agent/v1/responses":
-        return _query_responses_endpoint_stream(endpoint_name, messages, return_traces)
+        chunks = _query_responses_endpoint_stream(endpoint_name, messages, return_traces)
     else:
-        return _query_chat_endpoint_stream(endpoint_name, messages, return_traces)
+        chunks = _query_chat_endpoint_stream(endpoint_name, messages, return_traces)
+    if SINGLE_FLIGHT_ENABLED:
+        key = f"{conversation_key(endpoint_name, task_type, messages)}:{int(bool(return_traces))}"
+        return _single_flight_stream(endpoint_name, task_type, key, chunks, session_id, deadline, on_queue,
+                                     on_wait=on_wait, parse=parse, on_drained=on_drained)
+    guarded = guarded_stream(chunks, deadline=deadline, on_wait=on_wait, parse=parse, on_drained=on_drained)
+    return _admitted_stream(endpoint_name, guarded, session_id, deadline, on_queue)
+
+def _admitted_stream(endpoint_name, chunks, session_id, deadline, on_queue):
+    """Wait for an admission slot on first iteration and hold it until `chunks` ends or is closed."""
+    with admission_controller.slot(endpoint_name, session_id, deadline, on_queue):
+        yield from chunks
+
+def _single_flight_stream(endpoint_name, task_type, key, chunks, session_id, deadline, on_queue, **guard_options):
+    """
+    Follow the in-flight stream for the same payload if there is one (no
+    admission slot needed); otherwise register a flight for it, which waits
+    for a slot and then starts the stream. Identical requests that arrive
+    while it is still queued join it too.
+    """
+    subscription = single_flight.join(key)
+    started = False
+    if subscription is None:
+        # The upstream gets its own timeouts; the flight holds the slot until it ends
+        subscription, started = single_flight.start(
+            key, lambda: guarded_stream(chunks),
+            admit=lambda on_flight_queue: admission_controller.acquire(
+                endpoint_name, session_id, deadline, on_flight_queue),
+        )
+    if not started:
+        chunks.close()
+        metrics.increment("chatbot_single_flight_joins_total", task_type=task_type)
+    try:
+        subscription.wait_admitted(deadline, on_queue)
+    except BaseException:
+        subscription.close()
+        raise
+    yield from guarded_stream(subscription, deadline=deadline, **guard_options)
 
 def _query_chat_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
     """Invoke an endpoint that implements either chat completions or ChatAgent and stream the response"""
-    client = get_deploy_client("databricks")
+    client = get_deploy_client()
 
     # Prepare input payload
     inputs = {
@@ -94,7 +194,7 @@ def _query_chat_endpoint_stream(endpoint_name: str, messages: list[dict[str, str
 
 def _query_responses_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
     """Stream responses from agent/v1/responses endpoints using MLflow deployments client."""
-    client = get_deploy_client("databricks")
+    client = get_deploy_client()
     
     input_messages = _convert_to_responses_format(messages)
     
@@ -111,17 +211,30 @@ def _query_responses_endpoint_stream(endpoint_name: str, messages: list[dict[str
         # Just yield the raw event data, let app.py handle the parsing
         yield event_data
 
-def query_endpoint(endpoint_name, messages, return_traces):
+def query_endpoint(endpoint_name, messages, return_traces, task_type=None, deadline=None, session_id=None,
+                   on_queue=None):
     """
     Query an endpoint, returning the string message content and request
-    ID for feedback
+    ID for feedback. Raises deadlines.DeadlineExceeded if `deadline` passes
+    first, queueing for an admission slot included. The slot is held until
+    the call really ends, even one the deadline gave up on, so abandoned
+    calls still count against the endpoint's limit.
     """
-    task_type = _get_endpoint_task_type(endpoint_name)
+    if task_type is None:
+        task_type = _get_endpoint_task_type(endpoint_name)
+    _record_request_size(task_type, messages)
     
-    if task_type == "agent/v1/responses":
-        return _query_responses_endpoint(endpoint_name, messages, return_traces)
-    else:
-        return _query_chat_endpoint(endpoint_name, messages, return_traces)
+    release = admission_controller.acquire(endpoint_name, session_id, deadline, on_queue)
+    started = time.monotonic()
+    try:
+        if task_type == "agent/v1/responses":
+            return call_with_deadline(_query_responses_endpoint, deadline, endpoint_name, messages, return_traces,
+                                      on_done=release)
+        else:
+            return call_with_deadline(_query_chat_endpoint, deadline, endpoint_name, messages, return_traces,
+                                      on_done=release)
+    finally:
+        metrics.observe("chatbot_endpoint_call_seconds", time.monotonic() - started, task_type=task_type)
 
 def _query_chat_endpoint(endpoint_name, messages, return_traces):
     """Calls a model serving endpoint with chat/completions format."""
@@ -129,7 +242,7 @@ def _query_chat_endpoint(endpoint_name, messages, return_traces):
     if return_traces:
         inputs['databricks_options'] = {'return_trace': True}
     
-    res = get_deploy_client('databricks').predict(
+    res = get_deploy_client().predict(
         endpoint=endpoint_name,
         inputs=inputs,
     )
@@ -157,7 +270,7 @@ def _query_chat_endpoint(endpoint_name, messages, return_traces):
 
 def _query_responses_endpoint(endpoint_name, messages, return_traces):
     """Query agent/v1/responses endpoints using MLflow deployments client."""
-    client = get_deploy_client("databricks")
+    client = get_deploy_client()
     
     input_messages = _convert_to_responses_format(messages)
     
@@ -230,8 +343,8 @@ def _query_responses_endpoint(endpoint_name, messages, return_traces):
     
     return result_messages or [{"role": "assistant", "content": "No response found"}], request_id
 
-def submit_feedback(endpoint, request_id, rating):
-    """Submit feedback to the agent."""
+def feedback_record(request_id, rating):
+    """Build the feedback record for one rating of a response."""
     rating_string = "positive" if rating == 1 else "negative"
     text_assessments = [] if rating is None else [{
         "ratings": {
@@ -239,29 +352,33 @@ def submit_feedback(endpoint, request_id, rating):
         },
         "free_text_comment": None
     }]
+    return {
+        "source": json.dumps({
+            "id": "e2e-chatbot-app",  # Or extract from auth
+            "type": "human"
+        }),
+        "request_id": request_id,
+        "text_assessments": json.dumps(text_assessments),
+        "retrieval_assessments": json.dumps([]),
+    }
 
+def submit_feedback_batch(endpoint, records):
+    """Submit several feedback records to the agent in one request."""
     proxy_payload = {
-        "dataframe_records": [
-            {
-                "source": json.dumps({
-                    "id": "e2e-chatbot-app",  # Or extract from auth
-                    "type": "human"
-                }),
-                "request_id": request_id,
-                "text_assessments": json.dumps(text_assessments),
-                "retrieval_assessments": json.dumps([]),
-            }
-        ]
+        "dataframe_records": records
     }
-    w = WorkspaceClient()
+    w = get_workspace_client()
     return w.api_client.do(
         method='POST',
         path=f"/serving-endpoints/{endpoint}/served-models/feedback/invocations",
         body=proxy_payload,
     )
 
+def submit_feedback(endpoint, request_id, rating):
+    """Submit feedback to the agent."""
+    return submit_feedback_batch(endpoint, [feedback_record(request_id, rating)])
+
 
 def endpoint_supports_feedback(endpoint_name):
-    w = WorkspaceClient()
-    endpoint = w.serving_endpoints.get(endpoint_name)
-    return "feedback" in [entity.name for entity in endpoint.config.served_entities]
+    return get_endpoint_metadata(endpoint_name).supports_feedback
+
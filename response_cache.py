@@ -0,0 +1,179 @@
+"""
+Persistent exact-match cache of assistant responses.
+
+Many users ask the same questions, and each one costs a full generation on
+the serving endpoint. Responses are stored in a local SQLite file keyed on
+the endpoint plus a canonical hash of the normalized conversation, so a
+repeated question is answered from disk. Entries expire after a TTL and the
+least recently used ones are evicted to respect entry and size caps.
+
+SQLite runs in WAL mode with a busy timeout, so several Streamlit worker
+processes on the same host can share one cache file.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Set RESPONSE_CACHE_PATH to an empty string to disable the cache
+RESPONSE_CACHE_PATH = os.getenv(
+    "RESPONSE_CACHE_PATH", os.path.join(BASE_DIR, ".cache", "response_cache.sqlite3")
+)
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Ids are generated per run or per session and say nothing about the question
+_VOLATILE_KEYS = {"id", "call_id", "tool_call_id"}
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        normalized = {k: _normalize(v) for k, v in value.items() if k not in _VOLATILE_KEYS}
+        # Questions that only differ in case or spacing get the same answer
+        if normalized.get("role") == "user" and isinstance(normalized.get("content"), str):
+            normalized["content"] = normalized["content"].casefold()
+        return normalized
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def conversation_key(endpoint_name, task_type, messages):
+    """Canonical hash of a request: endpoint, task type and normalized messages."""
+    canonical = json.dumps(
+        {"endpoint": endpoint_name, "task_type": task_type, "messages": _normalize(messages)},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response cache with TTL and LRU eviction."""
+
+    def __init__(self, path, ttl=RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # sqlite3 connections can't be shared between threads
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " endpoint TEXT NOT NULL,"
+                " messages TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return the cached messages for `key`, or None on a miss."""
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT messages FROM responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, endpoint_name, messages):
+        """Store messages under `key` and evict entries over the caps."""
+        payload = json.dumps(messages, ensure_ascii=False)
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, messages, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint_name, payload, len(payload.encode("utf-8")), now, now),
+            )
+            self._evict(conn, now)
+
+    def invalidate(self, endpoint_name=None):
+        """Delete cached responses for one endpoint, or all of them."""
+        with self._connection() as conn:
+            if endpoint_name is None:
+                conn.execute("DELETE FROM responses")
+            else:
+                conn.execute("DELETE FROM responses WHERE endpoint = ?", (endpoint_name,))
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN"
+            " (SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        total = 0
+        stale_keys = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access DESC"):
+            total += size
+            if total > self.max_bytes:
+                stale_keys.append((key,))
+        if stale_keys:
+            conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+
+
+def _open_default_cache():
+    if not RESPONSE_CACHE_PATH:
+        return None
+    try:
+        return ResponseCache(RESPONSE_CACHE_PATH)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Response cache disabled, could not open {RESPONSE_CACHE_PATH}: {e}")
+        return None
+
+
+# Shared by every session in this process; None when disabled
+response_cache = _open_default_cache()
+
+
+def get_cached_response(endpoint_name, task_type, messages):
+    """Look up a cached response. Cache errors count as a miss."""
+    if response_cache is None:
+        return None
+    try:
+        return response_cache.get(conversation_key(endpoint_name, task_type, messages))
+    except sqlite3.Error as e:
+        logger.warning(f"Response cache lookup failed: {e}")
+        return None
+
+
+def cache_response(endpoint_name, task_type, messages, response_messages):
+    """Store a response. Cache errors are logged and otherwise ignored."""
+    if response_cache is None or not response_messages:
+        return
+    try:
+        response_cache.put(conversation_key(endpoint_name, task_type, messages), endpoint_name, response_messages)
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        logger.warning(f"Could not cache response: {e}")
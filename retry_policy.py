@@ -0,0 +1,113 @@
+"""
+Retry policy for streaming endpoint calls.
+
+A transient network error or a 429/5xx used to make every handler throw away
+the tokens already shown and redo the whole generation with a blocking call.
+Errors are now classified first: transient ones reopen the stream after a
+jittered exponential backoff (up to a capped number of attempts), requests
+the endpoint can't stream fall back to the non-streaming call, and anything
+else is reported as is so the caller can keep whatever was already streamed.
+"""
+import logging
+import os
+import random
+import re
+import time
+
+from deadlines import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+STREAM_MAX_ATTEMPTS = int(os.getenv("STREAM_MAX_ATTEMPTS", "3"))
+STREAM_RETRY_BASE_SECONDS = float(os.getenv("STREAM_RETRY_BASE_SECONDS", "0.5"))
+STREAM_RETRY_MAX_SECONDS = float(os.getenv("STREAM_RETRY_MAX_SECONDS", "8"))
+
+RETRYABLE = "retryable"
+UNSUPPORTED = "unsupported"
+FATAL = "fatal"
+
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+_STATUS_RE = re.compile(r"\b(?:status(?: code)?|HTTP(?: error)?)[^0-9]{0,10}([1-5][0-9]{2})\b", re.IGNORECASE)
+_UNSUPPORTED_RE = re.compile(r"stream(?:ing)?\b.{0,40}\b(?:not supported|unsupported|not implemented)"
+                             r"|(?:does not|doesn't|cannot) support stream", re.IGNORECASE)
+
+
+def _status_code(error):
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None and hasattr(error, "get_http_status_code"):
+        # MlflowException maps its error code to an HTTP status
+        try:
+            status = error.get_http_status_code()
+        except Exception:
+            status = None
+    if status is None:
+        match = _STATUS_RE.search(str(error))
+        if match:
+            status = int(match.group(1))
+    return status
+
+
+def classify_error(error):
+    """Classify an error from a streaming call as RETRYABLE, UNSUPPORTED or FATAL."""
+    if isinstance(error, NotImplementedError) or _UNSUPPORTED_RE.search(str(error)):
+        return UNSUPPORTED
+    if isinstance(error, DeadlineExceeded):
+        return FATAL
+    # Connection resets, timeouts and truncated chunked responses, whichever
+    # HTTP library raised them
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return RETRYABLE
+    if type(error).__name__ in ("ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout",
+                                "ChunkedEncodingError", "ProtocolError", "IncompleteRead"):
+        return RETRYABLE
+    if _status_code(error) in RETRYABLE_STATUS_CODES:
+        return RETRYABLE
+    return FATAL
+
+
+class StreamRetryPolicy:
+    """How often and how long to wait before reopening a failed stream."""
+
+    def __init__(self, max_attempts=STREAM_MAX_ATTEMPTS, base_delay=STREAM_RETRY_BASE_SECONDS,
+                 max_delay=STREAM_RETRY_MAX_SECONDS, classify=classify_error):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+
+    def backoff(self, attempt):
+        """Delay before retry number `attempt` (1-based), with full jitter."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def stream(self, open_stream, on_retry=None, deadline=None):
+        """
+        Yield chunks from `open_stream()`, reopening it on retryable errors.
+
+        A reopened stream starts the generation over, so `on_retry(attempt,
+        error)` is called before the backoff to let the consumer reset its
+        per-attempt state. Non-retryable errors, and the last error once
+        attempts run out or the backoff would overrun `deadline`, are raised
+        to the caller.
+        """
+        attempt = 1
+        while True:
+            try:
+                yield from open_stream()
+                return
+            except Exception as e:
+                if attempt >= self.max_attempts or self.classify(e) != RETRYABLE:
+                    raise
+                delay = self.backoff(attempt)
+                if deadline is not None and delay >= deadline.remaining():
+                    raise
+                logger.warning(f"Stream failed on attempt {attempt}/{self.max_attempts} ({e}), "
+                               f"retrying in {delay:.2f}s")
+                attempt += 1
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                time.sleep(delay)
+
+
+# Shared default used by the app's stream handlers
+stream_retry_policy = StreamRetryPolicy()
@@ -0,0 +1,498 @@
+"""
+Semantic cache of answers to first-turn questions.
+
+The exact-match cache in response_cache.py misses rewordings such as "How
+do I plant Brachiaria?" and "how to plant brachiaria". Here each first-turn
+question is embedded with a hashed word and character n-gram vectorizer (CPU
+only, no model download) and compared by cosine similarity against every
+cached question with a brute-force NumPy index.
+
+A lexical vectorizer can't tell what a sentence means. It only sees which
+words it uses, so near-identical vectors are no proof of the same question.
+Only articles, pronouns and similar filler are dropped before embedding.
+Question words, modals and negations stay in, because "when" and "where"
+or "can" and "should" ask different things. A cached answer is reused only
+when the similarity clears the threshold and the two questions also:
+- ask with the same question words, modals, negations and numbers, and
+- share at least SEMANTIC_CACHE_MIN_TERM_OVERLAP of their other stemmed
+  words (shared / all, 0.5 by default), and
+- don't swap words: only one of the two may have words the other lacks.
+
+That makes the hashed vectorizer a cache for reworded questions: filler,
+plurals, word order and the odd extra word. A swapped word can leave the
+vectors above the threshold ("stocking rate ... for cattle" against "...
+for goats" scores 0.92), so swaps are never served. Paraphrases that
+share no words ("best grass for dry season" and "drought tolerant forage
+grass") need a real sentence embedding model: set
+SEMANTIC_CACHE_EMBEDDING_MODEL to a sentence-transformers model name (the
+package is optional and not in requirements.txt). With a model, swapped
+words are allowed and the overlap requirement defaults to 0, so the
+threshold decides and only the question words must match. Tune
+SEMANTIC_CACHE_THRESHOLD for the model from the similarity histogram.
+
+The index is kept on disk so it survives restarts. New entries are
+written by a background thread, at most every SEMANTIC_CACHE_SAVE_DELAY_SECONDS,
+never on the Streamlit script thread. Each save takes a lock file, reads
+the file again, merges in what other processes saved since, and replaces
+it atomically, so concurrent processes don't overwrite each other's
+entries. A process picks up the others' entries when it starts and with
+each of its own saves.
+
+Lookups are counted in chatbot_semantic_cache_lookups_total (result=hit,
+miss or guarded, for matches above the threshold rejected by the word
+checks). The best similarity per lookup goes into the
+chatbot_semantic_cache_best_similarity histogram, so the threshold can be
+tuned from real traffic (see also SemanticCache.stats()).
+"""
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves from concurrent processes are not serialized
+    fcntl = None
+
+import numpy as np
+
+from metrics import SIMILARITY_BUCKETS, metrics
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Set SEMANTIC_CACHE_PATH to an empty string to keep the index in memory only
+SEMANTIC_CACHE_PATH = os.getenv(
+    "SEMANTIC_CACHE_PATH", os.path.join(BASE_DIR, ".cache", "semantic_cache.npz")
+)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+# New entries are batched and written to disk at most this often
+SEMANTIC_CACHE_SAVE_DELAY_SECONDS = float(os.getenv("SEMANTIC_CACHE_SAVE_DELAY_SECONDS", "10"))
+# sentence-transformers model to embed questions with; empty for the built-in hashed vectorizer
+SEMANTIC_CACHE_EMBEDDING_MODEL = os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "")
+# Share of content words a hit must have in common with the cached question (see terms_match)
+SEMANTIC_CACHE_MIN_TERM_OVERLAP = os.getenv("SEMANTIC_CACHE_MIN_TERM_OVERLAP", "")
+HASHED_MIN_TERM_OVERLAP = 0.5
+EMBEDDING_DIM = 2048
+HASHED_EMBEDDER_ID = "hashed-ngrams-v1"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Filler only: question words, modals and negations change what is asked
+_STOPWORDS = {
+    "a", "an", "and", "are", "do", "does", "for", "i", "in", "is", "it", "me", "my", "of", "on",
+    "or", "please", "the", "to", "with", "you",
+}
+# Words that set what kind of answer a question wants
+_FRAME_WORDS = {
+    "can", "cannot", "could", "how", "may", "might", "must", "never", "no", "not", "shall",
+    "should", "what", "when", "where", "which", "who", "why", "will", "without", "would", "don",
+    "doesn", "isn", "aren", "won", "shouldn",
+}
+
+
+def _stem(token):
+    for suffix in ("ing", "es", "s"):
+        if len(token) > len(suffix) + 3 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def _tokens(text):
+    return [_stem(t) for t in _TOKEN_RE.findall(text.casefold()) if t not in _STOPWORDS]
+
+
+def key_terms(text):
+    """Sorted stemmed words of `text`, filler dropped; stored with each entry for terms_match."""
+    return sorted(set(_tokens(text)))
+
+
+def terms_match(cached_terms, terms, min_overlap, allow_swaps=False):
+    """
+    Whether two questions' key terms are close enough to reuse an answer:
+    the same question words, modals, negations and numbers, and at least
+    `min_overlap` of their other words in common. Unless `allow_swaps`,
+    only one of them may have words the other lacks, so "... for cattle"
+    never matches "... for goats".
+    """
+    cached_terms, terms = set(cached_terms), set(terms)
+    cached_frame = {t for t in cached_terms if t in _FRAME_WORDS or t.isdigit()}
+    frame = {t for t in terms if t in _FRAME_WORDS or t.isdigit()}
+    if cached_frame != frame:
+        return False
+    cached_words, words = cached_terms - cached_frame, terms - frame
+    if not allow_swaps and cached_words - words and words - cached_words:
+        return False
+    union = cached_words | words
+    return not union or len(cached_words & words) / len(union) >= min_overlap
+
+
+def embed(text, dim=EMBEDDING_DIM):
+    """Embed text as an L2-normalized hashed bag of words, word bigrams and char 4-grams."""
+    tokens = _tokens(text)
+    features = [(token, 1.0) for token in tokens]
+    features += [(f"{a} {b}", 1.0) for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f" {token} "
+        features += [(padded[i:i + 4], 0.5) for i in range(max(len(padded) - 3, 1))]
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in features:
+        # crc32 is stable across processes, unlike hash(), so vectors can be persisted
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def load_sentence_embedder(model_name):
+    """
+    (embedder, dim) for a sentence-transformers model, or None if the
+    package or the model can't be loaded.
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(model_name)
+    except Exception as e:
+        logger.warning(f"Could not load embedding model {model_name!r}, using the hashed vectorizer: {e}")
+        return None
+
+    def embed_with_model(text, dim=None):
+        return np.asarray(model.encode([text], normalize_embeddings=True)[0], dtype=np.float32)
+
+    return embed_with_model, model.get_sentence_embedding_dimension()
+
+
+def _merge(older, newer, max_entries, now=None):
+    """
+    Merge two lists of (entry, vector) pairs, one per (scope, question), the
+    later entry winning; drop expired ones and keep the newest `max_entries`.
+    """
+    now = time.time() if now is None else now
+    merged = {}
+    for entry, vector in list(older) + list(newer):
+        if entry["expires_at"] > now:
+            key = (entry["scope"], entry["question"])
+            merged.pop(key, None)
+            merged[key] = (entry, vector)
+    return list(merged.values())[-max_entries:]
+
+
+@contextmanager
+def _file_lock(path):
+    """Hold an exclusive lock on `path` (created if missing) across processes."""
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def first_turn_question(messages):
+    """Return the question if `messages` is a first turn (one user message), else None."""
+    questions = []
+    for message in messages:
+        role = message.get("role")
+        if role == "user":
+            questions.append(message.get("content"))
+        elif role != "system":
+            return None
+    if len(questions) == 1 and isinstance(questions[0], str) and questions[0].strip():
+        return questions[0]
+    return None
+
+
+class SemanticCache:
+    """
+    In-process brute-force vector index of first-turn answers.
+
+    `embedder(text, dim)` must return an L2-normalized vector of `dim`
+    floats. `embedder_id` names it in the file on disk, so vectors from
+    another embedder are never compared with its own. See terms_match for
+    `min_term_overlap` and `allow_swaps`.
+    """
+
+    def __init__(self, path=None, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 ttl=SEMANTIC_CACHE_TTL_SECONDS, max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                 dim=EMBEDDING_DIM, embedder=embed, embedder_id=HASHED_EMBEDDER_ID,
+                 min_term_overlap=HASHED_MIN_TERM_OVERLAP, allow_swaps=False,
+                 save_delay=SEMANTIC_CACHE_SAVE_DELAY_SECONDS):
+        self.path = path
+        self.embedder = embedder
+        self.embedder_id = embedder_id
+        self.min_term_overlap = min_term_overlap
+        self.allow_swaps = allow_swaps
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.dim = dim
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        # Parallel to the rows of _vectors
+        self._entries = []  # dicts: scope, question, terms, messages, expires_at
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._guarded = 0
+        self._best_similarities = [0] * len(SIMILARITY_BUCKETS)
+        # Entries added since the last save, and the thread that saves them
+        self.save_delay = save_delay
+        self._unsaved = []
+        self._dirty = threading.Event()
+        self._stopping = threading.Event()
+        self._writer = None
+        self._save_lock = threading.Lock()
+        if path:
+            self._merge_into_memory(self._read())
+
+    def lookup(self, scope, question):
+        """Return cached messages for a question similar enough to `question`, or None."""
+        query = self.embedder(question, self.dim)
+        terms = key_terms(question)
+        now = time.time()
+        with self._lock:
+            best_similarity, match, guarded = None, None, False
+            if self._entries:
+                similarities = self._vectors @ query
+                for index in np.argsort(similarities)[::-1]:
+                    entry = self._entries[index]
+                    if entry["scope"] != scope or entry["expires_at"] <= now:
+                        continue
+                    similarity = float(similarities[index])
+                    if best_similarity is None:
+                        best_similarity = similarity
+                    if similarity < self.threshold:
+                        break
+                    if terms_match(entry["terms"], terms, self.min_term_overlap, self.allow_swaps):
+                        match = entry
+                        break
+                    guarded = True
+            self._record(best_similarity or 0.0)
+            if match is not None:
+                self._hits += 1
+                result = "hit"
+            else:
+                self._misses += 1
+                self._guarded += guarded
+                result = "guarded" if guarded else "miss"
+        metrics.increment("chatbot_semantic_cache_lookups_total", result=result)
+        if best_similarity is not None:
+            metrics.observe("chatbot_semantic_cache_best_similarity", best_similarity)
+        if match is None:
+            return None
+        logger.debug(f"Semantic cache hit: {match['question']!r}")
+        return match["messages"]
+
+    def add(self, scope, question, messages, ttl=None):
+        """Cache the answer to a first-turn question."""
+        vector = self.embedder(question, self.dim)
+        entry = {
+            "scope": scope,
+            "question": question,
+            "terms": key_terms(question),
+            "messages": messages,
+            "expires_at": time.time() + (self.ttl if ttl is None else ttl),
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self._vectors = np.vstack([self._vectors, vector[None, :]])
+            self._prune()
+            if self.path:
+                self._unsaved.append((entry, vector))
+        if self.path:
+            self._dirty.set()
+            self._ensure_writer()
+
+    def save(self):
+        """Merge the entries added since the last save into the file on disk."""
+        with self._save_lock:
+            with self._lock:
+                unsaved, self._unsaved = self._unsaved, []
+            if not unsaved or not self.path:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with _file_lock(f"{self.path}.lock"):
+                    on_disk = self._read()
+                    merged = _merge(on_disk, unsaved, self.max_entries)
+                    self._write(merged)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning(f"Could not persist semantic cache to {self.path}: {e}")
+                with self._lock:
+                    # Try again with the next save
+                    self._unsaved[:0] = unsaved
+                return
+            # Pick up what other processes saved meanwhile
+            self._merge_into_memory(on_disk)
+
+    def close(self, timeout=10.0):
+        """Save pending entries and stop the writer thread."""
+        self._stopping.set()
+        self._dirty.set()
+        writer = self._writer
+        if writer is not None and writer.is_alive():
+            writer.join(timeout)
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer is not None and self._writer.is_alive():
+                return
+            self._writer = threading.Thread(target=self._run_writer, name="semantic-cache-writer", daemon=True)
+            self._writer.start()
+
+    def _run_writer(self):
+        while not self._stopping.is_set():
+            self._dirty.wait()
+            # Batch whatever else arrives shortly after; close() cuts the wait short
+            self._stopping.wait(self.save_delay)
+            self._dirty.clear()
+            self.save()
+        self.save()
+
+    def stats(self):
+        """Hit/miss counts and a histogram of the best similarity seen per lookup."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "guarded": self._guarded,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "min_term_overlap": self.min_term_overlap,
+                "best_similarity_le": dict(zip(SIMILARITY_BUCKETS, self._best_similarities)),
+            }
+
+    def _record(self, similarity):
+        # Float error can push identical vectors slightly above 1
+        similarity = min(similarity, 1.0)
+        for i, upper in enumerate(SIMILARITY_BUCKETS):
+            if similarity <= upper:
+                self._best_similarities[i] += 1
+
+    def _prune(self):
+        now = time.time()
+        keep = [i for i, entry in enumerate(self._entries) if entry["expires_at"] > now]
+        # Oldest entries go first when over capacity
+        keep = keep[-self.max_entries:]
+        if len(keep) != len(self._entries):
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep]
+
+    def _merge_into_memory(self, pairs):
+        if not pairs:
+            return
+        with self._lock:
+            merged = _merge(pairs, zip(self._entries, self._vectors), self.max_entries)
+            self._entries = [entry for entry, _ in merged]
+            self._vectors = (np.stack([vector for _, vector in merged]).astype(np.float32) if merged
+                             else np.zeros((0, self.dim), dtype=np.float32))
+
+    def _read(self):
+        """(entry, vector) pairs saved at self.path; empty if missing or unreadable."""
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with np.load(self.path) as data:
+                vectors = data["vectors"]
+                entries = json.loads(str(data["entries"]))
+                embedder_id = str(data["embedder"]) if "embedder" in data else HASHED_EMBEDDER_ID
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Could not load semantic cache from {self.path}: {e}")
+            return []
+        if embedder_id != self.embedder_id:
+            logger.warning(f"Ignoring semantic cache at {self.path}: it was built with {embedder_id}, the next save replaces it")
+            return []
+        if vectors.shape != (len(entries), self.dim):
+            logger.warning(f"Ignoring semantic cache at {self.path}: index shape does not match")
+            return []
+        for entry in entries:
+            # Entries saved before key terms were stored
+            entry.setdefault("terms", key_terms(entry["question"]))
+        return list(zip(entries, vectors.astype(np.float32)))
+
+    def _write(self, pairs):
+        """Replace the file at self.path with `pairs`, atomically."""
+        vectors = (np.stack([vector for _, vector in pairs]) if pairs
+                   else np.zeros((0, self.dim), dtype=np.float32))
+        entries = [entry for entry, _ in pairs]
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        try:
+            np.savez(tmp_path, vectors=vectors, entries=np.array(json.dumps(entries)),
+                     embedder=np.array(self.embedder_id))
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _build_semantic_cache():
+    options = {}
+    if SEMANTIC_CACHE_EMBEDDING_MODEL:
+        loaded = load_sentence_embedder(SEMANTIC_CACHE_EMBEDDING_MODEL)
+        if loaded is not None:
+            embedder, dim = loaded
+            options = dict(embedder=embedder, dim=dim, embedder_id=SEMANTIC_CACHE_EMBEDDING_MODEL,
+                           min_term_overlap=0.0, allow_swaps=True)
+    if SEMANTIC_CACHE_MIN_TERM_OVERLAP:
+        options["min_term_overlap"] = float(SEMANTIC_CACHE_MIN_TERM_OVERLAP)
+    cache = SemanticCache(path=SEMANTIC_CACHE_PATH or None, **options)
+    atexit.register(cache.close)
+    return cache
+
+
+_cache_lock = threading.Lock()
+_semantic_cache = None
+
+
+def get_semantic_cache():
+    """
+    The cache shared by every session in this process, None when disabled.
+    Built on first use, as loading an embedding model can take a while
+    (warm_start.py does it in the background).
+    """
+    global _semantic_cache
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = _build_semantic_cache()
+        return _semantic_cache
+
+
+def _scope(endpoint_name, task_type):
+    return f"{endpoint_name}|{task_type}"
+
+
+def get_semantic_match(endpoint_name, task_type, messages):
+    """Return a cached answer to a paraphrase of a first-turn question, or None."""
+    question = first_turn_question(messages)
+    if question is None:
+        return None
+    cache = get_semantic_cache()
+    if cache is None:
+        return None
+    return cache.lookup(_scope(endpoint_name, task_type), question)
+
+
+def add_semantic_entry(endpoint_name, task_type, messages, response_messages):
+    """Remember the answer to a first-turn question."""
+    question = first_turn_question(messages)
+    if question is None or not response_messages:
+        return
+    cache = get_semantic_cache()
+    if cache is None:
+        return
+    cache.add(_scope(endpoint_name, task_type), question, response_messages)
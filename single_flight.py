@@ -0,0 +1,229 @@
+"""
+Single-flight coalescing of identical in-flight streams.
+
+When several users send the same question at about the same moment (a
+workshop handout prompt, say), each of them used to start a generation of
+its own. Now the first request for a canonical payload (see
+response_cache.conversation_key) becomes a flight: one background thread
+reads the upstream stream into a broadcast buffer, and every request with
+the same key that arrives while it is running subscribes to that buffer
+instead of calling the endpoint. Late joiners first replay the chunks
+received so far, then follow along live.
+
+A flight is registered before it waits for its admission slot (see
+admission.py), so identical requests arriving during a burst, while the
+first one is still queued, join it instead of queueing on their own. The
+flight's thread does the waiting, and holds the slot until the upstream
+ends. Subscribers wait for it on their own threads with
+Subscription.wait_admitted, which reports the flight's queue position.
+Followers never take a slot. If every subscriber goes away (Stop
+generating, new prompts) the flight leaves the queue, or the upstream is
+closed early. A failed upstream, or a flight that was not admitted, raises
+the same error in every subscriber, and each session's retry policy then
+starts or joins a new flight.
+
+Flights are forgotten once they end. A repeat after that is a new request,
+unless the response cache answers it.
+"""
+import logging
+import os
+import threading
+import time
+
+from deadlines import WAIT_POLL_SECONDS, Deadline
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class _Abandoned(Exception):
+    """Every subscriber left a flight that was still waiting for its slot."""
+
+
+class Flight:
+    """Broadcast buffer of one upstream stream: every chunk so far, plus how it ended."""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.admitted = False
+        # (queue position, estimated seconds) while waiting for an admission slot
+        self.queue_status = None
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.started_at = time.monotonic()
+
+
+class Subscription:
+    """
+    One subscriber's view of a flight: iterate it for the chunks from the
+    first one on, close it to leave. Iteration ending, either way, closes it.
+    """
+
+    def __init__(self, registry, flight):
+        self.flight = flight
+        self._registry = registry
+        self._chunks = registry._follow(flight)
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def wait_admitted(self, deadline=None, on_queue=None):
+        """
+        Wait until the flight holds its admission slot, or has ended. Calls
+        `on_queue(position, estimated_seconds)` about once a second while it
+        is queued and `on_queue(None, None)` once admitted, like
+        AdmissionController.acquire.
+        """
+        self._registry._wait_admitted(self.flight, deadline or Deadline(), on_queue)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._chunks.close()
+            self._registry._leave(self.flight)
+
+
+class SingleFlight:
+    """Process-wide registry of in-flight streams keyed by canonical request payload."""
+
+    def __init__(self):
+        # One condition guards the registry and every flight's buffer
+        self._cond = threading.Condition()
+        self._flights = {}
+
+    def join(self, key):
+        """Subscribe to the in-flight stream for `key`; None if there is none."""
+        with self._cond:
+            flight = self._flights.get(key)
+            if flight is None:
+                return None
+            flight.subscribers += 1
+        logger.info(f"Joined in-flight stream {key[:12]} ({len(flight.chunks)} chunks to replay)")
+        return Subscription(self, flight)
+
+    def start(self, key, open_stream, admit=None):
+        """
+        Register a flight for `key` and subscribe to it. A background thread
+        calls `admit(on_queue)`, which must wait for an admission slot and
+        return the function that gives it back, then reads `open_stream()`
+        into the flight and gives the slot back once the upstream ends.
+
+        If another caller registered a flight for `key` first, that one is
+        joined instead. Returns (subscription, started).
+        """
+        with self._cond:
+            flight = self._flights.get(key)
+            started = flight is None
+            if started:
+                flight = self._flights[key] = Flight(key)
+            flight.subscribers += 1
+        if started:
+            threading.Thread(target=self._produce, args=(flight, open_stream, admit),
+                             name="single-flight", daemon=True).start()
+        return Subscription(self, flight), started
+
+    def in_flight(self):
+        with self._cond:
+            return len(self._flights)
+
+    def _produce(self, flight, open_stream, admit):
+        error = None
+        stream = None
+        release = None
+        try:
+            if admit is not None:
+                release = admit(lambda position, estimate: self._queued(flight, position, estimate))
+            with self._cond:
+                flight.admitted = True
+                flight.queue_status = None
+                self._cond.notify_all()
+            stream = open_stream()
+            for chunk in stream:
+                with self._cond:
+                    if flight.subscribers == 0:
+                        logger.info(f"Every subscriber of stream {flight.key[:12]} left, closing it")
+                        break
+                    flight.chunks.append(chunk)
+                    self._cond.notify_all()
+        except _Abandoned:
+            logger.info(f"Every subscriber of stream {flight.key[:12]} left while it was queued")
+        except Exception as e:
+            error = e
+        finally:
+            try:
+                if stream is not None:
+                    stream.close()
+            finally:
+                with self._cond:
+                    flight.done = True
+                    flight.error = error
+                    self._forget(flight)
+                    self._cond.notify_all()
+                if release is not None:
+                    release()
+
+    def _queued(self, flight, position, estimate):
+        """on_queue for the flight's own admission wait; gives up once nobody is subscribed."""
+        with self._cond:
+            if flight.subscribers == 0:
+                raise _Abandoned()
+            flight.queue_status = None if position is None else (position, estimate)
+            self._cond.notify_all()
+
+    def _wait_admitted(self, flight, deadline, on_queue):
+        reported = False
+        while True:
+            with self._cond:
+                if not (flight.admitted or flight.done):
+                    deadline.check()
+                    self._cond.wait(min(WAIT_POLL_SECONDS, deadline.remaining()))
+                if flight.admitted or flight.done:
+                    break
+                status = flight.queue_status
+            if on_queue is not None and status is not None:
+                reported = True
+                on_queue(*status)
+        if reported:
+            on_queue(None, None)
+
+    def _follow(self, flight):
+        """Replay `flight` from its first chunk, then follow it until it ends."""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(flight.chunks) and not flight.done:
+                    self._cond.wait()
+                chunks = flight.chunks[index:]
+                index += len(chunks)
+                finished = flight.done
+            yield from chunks
+            if finished:
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    def _leave(self, flight):
+        with self._cond:
+            flight.subscribers -= 1
+            if flight.subscribers == 0:
+                # Nobody is listening: new requests must not join a stream about to be closed
+                self._forget(flight)
+
+    def _forget(self, flight):
+        """Drop `flight` from the registry. Lock held."""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+
+single_flight = SingleFlight()
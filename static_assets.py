@@ -0,0 +1,183 @@
+"""
+Optimized page assets, prepared once per process.
+
+The header used to read public/headerv2.jpg and public/logo.png on every
+rerun and inline them as base64 (about 330 KB per interaction, per client).
+Now each image is resized to the sizes it is displayed at, re-encoded as
+WebP and written to static/ under a content-hashed name. Streamlit serves
+that directory at app/static/ when server.enableStaticServing is on (see
+.streamlit/config.toml). The URLs carry a ?v=<hash> query, and for those
+the static file handler sends a ten-year Cache-Control max-age, so a
+browser downloads each variant once. When static serving is off, or
+static/ can't be written (a read-only deployment), the optimized variant
+is inlined as a data URI instead. That is still a fraction of the original.
+
+Streamlit drops any element a rerun doesn't emit again, so the page CSS
+can't be sent only once per session. It is read from public/app.css and
+minified once per process, and every rerun re-sends the same small string.
+
+Like messages.py, this module is imported rather than executed by the
+Streamlit script, so its caches survive reruns.
+"""
+import base64
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+from typing import NamedTuple
+
+from PIL import Image
+from streamlit import config as st_config
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PUBLIC_DIR = os.path.join(BASE_DIR, "public")
+# Streamlit serves <app dir>/static at app/static when static serving is enabled
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+STATIC_URL_PATH = "app/static"
+
+ASSET_IMAGE_FORMAT = os.getenv("ASSET_IMAGE_FORMAT", "WEBP").upper()
+ASSET_IMAGE_QUALITY = int(os.getenv("ASSET_IMAGE_QUALITY", "82"))
+
+_MIME_TYPES = {"WEBP": "image/webp", "PNG": "image/png", "JPEG": "image/jpeg"}
+
+
+class ImageAsset(NamedTuple):
+    """An image ready for an <img> tag: `src` plus a `srcset` for high-density screens."""
+    src: str
+    srcset: str
+
+
+def _encode_variant(name, height):
+    """`name` from public/ scaled to `height` pixels (never upscaled); returns (bytes, format)."""
+    with Image.open(os.path.join(PUBLIC_DIR, name)) as image:
+        image.load()
+        source_format = image.format
+        if image.height > height:
+            width = max(1, round(image.width * height / image.height))
+            image = image.resize((width, height), Image.LANCZOS)
+        for image_format in (ASSET_IMAGE_FORMAT, source_format):
+            buffer = io.BytesIO()
+            try:
+                if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                image.save(buffer, format=image_format, quality=ASSET_IMAGE_QUALITY, optimize=True)
+            except (KeyError, OSError) as e:
+                # Pillow built without the encoder
+                logger.warning(f"Could not encode {name} as {image_format}: {e}")
+                continue
+            return buffer.getvalue(), image_format
+    raise OSError(f"Could not encode {name}")
+
+
+def _publish(name, height, data, image_format):
+    """Write a variant to static/ under a content-hashed name; returns its versioned URL."""
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem = os.path.splitext(name)[0]
+    filename = f"{stem}-{height}.{digest}.{image_format.lower()}"
+    path = os.path.join(STATIC_DIR, filename)
+    if not os.path.exists(path):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return f"{STATIC_URL_PATH}/{filename}?v={digest}"
+
+
+def _data_uri(data, image_format):
+    return f"data:{_MIME_TYPES.get(image_format, 'application/octet-stream')};base64,{base64.b64encode(data).decode()}"
+
+
+class StaticAssets:
+    """Process-wide cache of optimized image variants and minified CSS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._images = {}
+        self._variants = {}
+        self._css = {}
+
+    def variant(self, name, height):
+        """(bytes, format) of `name` scaled to `height` pixels, encoded once per process."""
+        key = (name, height)
+        with self._lock:
+            if key not in self._variants:
+                self._variants[key] = _encode_variant(name, height)
+            return self._variants[key]
+
+    def image(self, name, height, densities=(1, 2)):
+        """ImageAsset for showing `name` at `height` CSS pixels."""
+        key = (name, height, densities)
+        with self._lock:
+            asset = self._images.get(key)
+        if asset is not None:
+            return asset
+        try:
+            asset = self._build_image(name, height, densities)
+        except OSError as e:
+            logger.warning(f"Could not prepare {name}, inlining the original: {e}")
+            with open(os.path.join(PUBLIC_DIR, name), "rb") as f:
+                data = f.read()
+            asset = ImageAsset(src=_data_uri(data, Image.registered_extensions().get(
+                os.path.splitext(name)[1].lower(), "")), srcset="")
+        with self._lock:
+            self._images[key] = asset
+        return asset
+
+    def _build_image(self, name, height, densities):
+        variants = [(density, *self.variant(name, height * density)) for density in densities]
+        if st_config.get_option("server.enableStaticServing"):
+            try:
+                urls = [(density, _publish(name, height * density, data, image_format))
+                        for density, data, image_format in variants]
+                return ImageAsset(src=urls[0][1], srcset=", ".join(f"{url} {density}x" for density, url in urls))
+            except OSError as e:
+                logger.warning(f"Could not write {name} to {STATIC_DIR}, inlining it: {e}")
+        # One inlined copy, at the highest density so it stays sharp everywhere
+        _, data, image_format = variants[-1]
+        return ImageAsset(src=_data_uri(data, image_format), srcset="")
+
+    def inline_css(self, name):
+        """`<style>` tag with public/`name`, minified once per process."""
+        with self._lock:
+            if name not in self._css:
+                with open(os.path.join(PUBLIC_DIR, name), encoding="utf-8") as f:
+                    self._css[name] = f"<style>{minify_css(f.read())}</style>"
+            return self._css[name]
+
+
+def minify_css(css):
+    """Drop comments and the whitespace CSS doesn't need."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+static_assets = StaticAssets()
+
+
+def image_asset(name, height, densities=(1, 2)):
+    return static_assets.image(name, height, densities)
+
+
+def small_image(name, height):
+    """
+    Encoded bytes of a small variant, for avatars and the page icon.
+
+    Falls back to the original file's path, which Streamlit accepts too.
+    """
+    try:
+        return static_assets.variant(name, height)[0]
+    except OSError as e:
+        logger.warning(f"Could not prepare {name}: {e}")
+        return os.path.join(PUBLIC_DIR, name)
+
+
+def inline_css(name="app.css"):
+    return static_assets.inline_css(name)
@@ -0,0 +1,90 @@
+"""
+Fast-path parsing of streamed endpoint chunks.
+
+Validating every chunk with ChatAgentChunk.model_validate or
+ResponsesAgentStreamEvent.model_validate costs several microseconds of
+pydantic work per token, which dominated client-side CPU on long answers.
+Nearly all chunks are plain text deltas, so those are checked by hand on the
+raw dicts: only the fields the app reads, with the types the MLflow models
+require. Anything else (tool calls and results, finish chunks, completed
+output items, event types not seen before, or a delta with extra fields)
+still goes through full model validation.
+
+Set STREAM_PARSE_STRICT=true to validate every chunk, e.g. while debugging
+an endpoint that sends malformed deltas.
+
+The parsers run on the stream reader thread (see deadlines.guarded_stream).
+"""
+import os
+
+from stream_reducers import _dump_message
+
+STREAM_PARSE_STRICT = os.getenv("STREAM_PARSE_STRICT", "false").lower() in ("1", "true", "yes")
+
+# Fields a plain ChatAgent content delta may carry, and the chunk around it
+_CONTENT_DELTA_KEYS = frozenset({"role", "content", "id", "name"})
+_CONTENT_CHUNK_KEYS = frozenset({"delta", "finish_reason", "databricks_output"})
+# Fields of a ResponsesAgent response.output_text.delta event
+_TEXT_DELTA_EVENT_KEYS = frozenset({"type", "item_id", "delta", "output_index", "content_index", "databricks_output"})
+
+
+def _is_content_delta_chunk(raw_chunk):
+    """Whether a raw ChatAgent chunk is a plain assistant text delta that needs no validation."""
+    if not isinstance(raw_chunk, dict) or not raw_chunk.keys() <= _CONTENT_CHUNK_KEYS:
+        return False
+    if raw_chunk.get("finish_reason") is not None:
+        return False
+    delta = raw_chunk.get("delta")
+    return (
+        isinstance(delta, dict)
+        and delta.keys() <= _CONTENT_DELTA_KEYS
+        and delta.get("role") == "assistant"
+        and isinstance(delta.get("id"), str)
+        and isinstance(delta.get("content"), str)
+        and isinstance(delta.get("name"), (str, type(None)))
+    )
+
+
+def _is_text_delta_event(raw_event):
+    """Whether a raw Responses event is an output_text delta that needs no validation."""
+    return (
+        isinstance(raw_event, dict)
+        and raw_event.get("type") == "response.output_text.delta"
+        and raw_event.keys() <= _TEXT_DELTA_EVENT_KEYS
+        and isinstance(raw_event.get("item_id"), str)
+        and isinstance(raw_event.get("delta"), str)
+        and isinstance(raw_event.get("output_index"), (int, type(None)))
+        and isinstance(raw_event.get("content_index"), (int, type(None)))
+    )
+
+
+def parse_chat_agent_chunk(raw_chunk, strict=None):
+    """
+    Parse a raw ChatAgent chunk into (raw chunk, delta dict).
+
+    The delta is the raw dict for plain text deltas, and the dumped
+    ChatAgentMessage otherwise. Raises pydantic's ValidationError for
+    malformed chunks.
+    """
+    if not (STREAM_PARSE_STRICT if strict is None else strict) and _is_content_delta_chunk(raw_chunk):
+        return raw_chunk, raw_chunk["delta"]
+    from mlflow.types.agent import ChatAgentChunk
+
+    return raw_chunk, _dump_message(ChatAgentChunk.model_validate(raw_chunk).delta)
+
+
+def parse_responses_event(raw_event, strict=None):
+    """
+    Validate a raw ResponsesAgent stream event and return it unchanged.
+
+    Chunks without a "type" are passed through, as the handler ignores
+    them. Raises pydantic's ValidationError for malformed events.
+    """
+    if "type" not in raw_event:
+        return raw_event
+    if not (STREAM_PARSE_STRICT if strict is None else strict) and _is_text_delta_event(raw_event):
+        return raw_event
+    from mlflow.types.responses import ResponsesAgentStreamEvent
+
+    ResponsesAgentStreamEvent.model_validate(raw_event)
+    return raw_event
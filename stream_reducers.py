@@ -0,0 +1,205 @@
+"""
+Reducers that fold streamed endpoint chunks into chat messages.
+
+Streaming handlers need the partial message after every chunk and the final
+message at the end. Re-reducing the whole chunk list each time is quadratic
+in the length of the reply, so the accumulators here fold each delta in once
+and build the message on demand.
+"""
+from collections import OrderedDict
+
+
+def _dump_message(message):
+    """model_dump a ChatAgentMessage; model_dump_compat only exists on MLflow 2.x."""
+    if hasattr(message, "model_dump_compat"):
+        return message.model_dump_compat(exclude_none=True)
+    return message.model_dump(exclude_none=True)
+
+
+def _field(obj, name, default=None):
+    """Read a field from a pydantic object or from its raw dict form."""
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+class ChatAgentMessageAccumulator:
+    """
+    Incrementally reduce the ChatAgentChunk deltas of one message.
+
+    Content pieces are collected, tool call arguments are concatenated per
+    call id and the latest tool_call_id is kept. message() returns the same
+    dict reduce_chat_agent_chunks(...).model_dump_compat(exclude_none=True)
+    would, without touching earlier deltas again. Deltas can be
+    ChatAgentMessage objects or raw delta dicts (see stream_parsers.py).
+    """
+
+    def __init__(self):
+        self._base = None
+        self._content_parts = []
+        self._tool_calls = OrderedDict()  # call id -> tool call dict
+        self._tool_call_id = None
+
+    def add(self, delta):
+        """Fold one ChatAgentMessage delta, or its dict form, into the message."""
+        if self._base is None:
+            if isinstance(delta, dict):
+                self._base = {key: value for key, value in delta.items() if value is not None}
+            else:
+                self._base = _dump_message(delta)
+
+        content = _field(delta, "content")
+        if content:
+            self._content_parts.append(content)
+
+        for tool_call in _field(delta, "tool_calls") or ():
+            call_id = _field(tool_call, "id")
+            if not call_id:
+                continue
+            function_info = _field(tool_call, "function")
+            func_name = (_field(function_info, "name") or "") if function_info else ""
+            func_args = (_field(function_info, "arguments") or "") if function_info else ""
+
+            existing = self._tool_calls.get(call_id)
+            if existing is None:
+                self._tool_calls[call_id] = {
+                    "id": call_id,
+                    "type": _field(tool_call, "type", "function"),
+                    "function": {"name": func_name, "arguments": func_args},
+                }
+            else:
+                existing["function"]["arguments"] += func_args
+                if func_name:
+                    existing["function"]["name"] = func_name
+
+        tool_call_id = _field(delta, "tool_call_id")
+        if tool_call_id:
+            self._tool_call_id = tool_call_id
+
+    def message(self):
+        """Return the message accumulated so far as a dict."""
+        if len(self._content_parts) > 1:
+            self._content_parts = ["".join(self._content_parts)]
+        message = dict(self._base or {})
+        message["content"] = self._content_parts[0] if self._content_parts else ""
+        if self._tool_calls:
+            message["tool_calls"] = [
+                {**tool_call, "function": dict(tool_call["function"])}
+                for tool_call in self._tool_calls.values()
+            ]
+        if self._tool_call_id:
+            message["tool_call_id"] = self._tool_call_id
+        return message
+
+
+def reduce_chat_agent_chunks(chunks):
+    """
+    Reduce a list of ChatAgentChunk objects corresponding to a particular
+    message into a single ChatAgentMessage
+
+    Streaming handlers use ChatAgentMessageAccumulator instead; this is kept
+    for callers that already hold the complete list of chunks.
+    """
+    deltas = [chunk.delta for chunk in chunks]
+    first_delta = deltas[0]
+    result_msg = first_delta
+    msg_contents = []
+
+    # Accumulate tool calls properly
+    tool_call_map = {}  # Map call_id to tool call for accumulation
+
+    for delta in deltas:
+        # Handle content
+        if delta.content:
+            msg_contents.append(delta.content)
+
+        # Handle tool calls
+        if hasattr(delta, 'tool_calls') and delta.tool_calls:
+            for tool_call in delta.tool_calls:
+                call_id = getattr(tool_call, 'id', None)
+                tool_type = getattr(tool_call, 'type', "function")
+                function_info = getattr(tool_call, 'function', None)
+                if function_info:
+                    func_name = getattr(function_info, 'name', "")
+                    func_args = getattr(function_info, 'arguments', "")
+                else:
+                    func_name = ""
+                    func_args = ""
+
+                if call_id:
+                    if call_id not in tool_call_map:
+                        # New tool call
+                        tool_call_map[call_id] = {
+                            "id": call_id,
+                            "type": tool_type,
+                            "function": {
+                                "name": func_name,
+                                "arguments": func_args
+                            }
+                        }
+                    else:
+                        # Accumulate arguments for existing tool call
+                        existing_args = tool_call_map[call_id]["function"]["arguments"]
+                        tool_call_map[call_id]["function"]["arguments"] = existing_args + func_args
+
+                        # Update function name if provided
+                        if func_name:
+                            tool_call_map[call_id]["function"]["name"] = func_name
+
+        # Handle tool call IDs (for tool response messages)
+        if hasattr(delta, 'tool_call_id') and delta.tool_call_id:
+            result_msg = result_msg.model_copy(update={"tool_call_id": delta.tool_call_id})
+
+    # Convert tool call map back to list
+    if tool_call_map:
+        accumulated_tool_calls = list(tool_call_map.values())
+        result_msg = result_msg.model_copy(update={"tool_calls": accumulated_tool_calls})
+
+    result_msg = result_msg.model_copy(update={"content": "".join(msg_contents)})
+    return result_msg
+
+
+class ResponsesOutputTextAccumulator:
+    """
+    Accumulate ResponsesAgent `response.output_text.delta` events per item.
+
+    Deltas are collected under their item_id until the matching
+    `response.output_item.done` message arrives; the handler then swaps in the
+    final item, so history never holds both the streamed text and the final
+    message.
+    """
+
+    def __init__(self):
+        self._parts = OrderedDict()  # item id -> list of text pieces
+        self._finished = set()
+
+    def add(self, item_id, delta):
+        """Append a text delta to an item."""
+        self._parts.setdefault(item_id, []).append(delta)
+
+    def text(self, item_id):
+        """Text streamed so far for an item."""
+        parts = self._parts.get(item_id)
+        if not parts:
+            return ""
+        if len(parts) > 1:
+            parts[:] = ["".join(parts)]
+        return parts[0]
+
+    def messages(self, item_id):
+        """The streamed text of an item as chat messages."""
+        text = self.text(item_id)
+        return [{"role": "assistant", "content": text}] if text else []
+
+    def finish(self, item_id=None):
+        """
+        Mark an item as completed and return the id it was streamed under.
+
+        Final items normally carry the same id as their deltas; if one comes
+        without an id it is matched to the oldest item still streaming.
+        """
+        if item_id is None:
+            item_id = next((i for i in self._parts if i not in self._finished), None)
+        if item_id is not None:
+            self._finished.add(item_id)
+        return item_id
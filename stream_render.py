@@ -0,0 +1,139 @@
+"""
+Helpers for rendering streamed answers in Streamlit.
+
+Every call to a placeholder's markdown() re-sends the whole element to the
+browser, which re-parses it. Doing that once per token makes long answers
+quadratic in both websocket traffic and frontend work, so deltas are
+coalesced here and only flushed to the page every so often.
+"""
+import os
+import time
+
+# Flush at most this often, unless enough new content piled up first
+STREAM_FLUSH_INTERVAL_SECONDS = float(os.getenv("STREAM_FLUSH_INTERVAL_SECONDS", "0.1"))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "1024"))
+
+
+class StreamRenderBuffer:
+    """
+    Coalesce streamed deltas and hand them to `render` in batches.
+
+    `render` is called with the full accumulated text whenever at least
+    `flush_interval` seconds passed since the last flush or `flush_bytes` of
+    new content is pending. The first delta is rendered right away so time to
+    first token is unaffected. Callers that render something other than the
+    text (e.g. structured messages) can use mark_dirty() instead of append().
+    When the stream goes quiet, call maybe_flush() again after the delay it
+    returns, so held-back content still shows up. Always call flush() once
+    the stream ends.
+    """
+
+    def __init__(self, render, flush_interval=STREAM_FLUSH_INTERVAL_SECONDS,
+                 flush_bytes=STREAM_FLUSH_BYTES):
+        self._render = render
+        self._flush_interval = flush_interval
+        self._flush_bytes = flush_bytes
+        self._parts = []
+        self._pending_bytes = 0
+        self._dirty = False
+        self._last_flush = None
+
+    @property
+    def text(self):
+        """All text appended so far."""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def append(self, delta):
+        """Add a text delta and flush if the interval or size threshold is reached."""
+        if not delta:
+            return
+        self._parts.append(delta)
+        self.mark_dirty(len(delta.encode("utf-8")))
+
+    def mark_dirty(self, nbytes=0):
+        """Record that `nbytes` of new content is waiting to be rendered."""
+        self._pending_bytes += nbytes
+        self._dirty = True
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        """
+        Flush if there is pending content and a threshold has been reached.
+
+        Returns the seconds until pending content is due regardless, or None
+        when nothing is left pending.
+        """
+        if not self._dirty:
+            return None
+        since_flush = None if self._last_flush is None else time.monotonic() - self._last_flush
+        if (since_flush is None
+                or self._pending_bytes >= self._flush_bytes
+                or since_flush >= self._flush_interval):
+            self.flush()
+            return None
+        return self._flush_interval - since_flush
+
+    def flush(self):
+        """Render pending content now."""
+        if not self._dirty:
+            return
+        self._render(self.text)
+        self._pending_bytes = 0
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+
+class KeyedStreamRenderer:
+    """
+    Render a stream of keyed items, each into its own placeholder.
+
+    A placeholder (from `make_placeholder`, e.g. st.empty) is created the
+    first time a key is seen, so earlier items are never re-rendered when a
+    later one arrives or changes. Each item is drawn with
+    `render_item(placeholder, value)` through its own StreamRenderBuffer.
+    """
+
+    def __init__(self, make_placeholder, render_item, **buffer_options):
+        self._make_placeholder = make_placeholder
+        self._render_item = render_item
+        self._buffer_options = buffer_options
+        self._items = {}  # key -> [value, placeholder, render buffer]
+
+    def __len__(self):
+        return len(self._items)
+
+    def update(self, key, value, nbytes=0):
+        """Set the value for `key` and schedule a re-render of that item only."""
+        entry = self._items.get(key)
+        if entry is None:
+            placeholder = self._make_placeholder()
+            entry = [value, placeholder, None]
+            entry[2] = StreamRenderBuffer(
+                lambda _: self._render_item(placeholder, entry[0]), **self._buffer_options
+            )
+            self._items[key] = entry
+        else:
+            entry[0] = value
+        entry[2].mark_dirty(nbytes)
+
+    def values(self):
+        """Item values in the order their keys were first seen."""
+        return [entry[0] for entry in self._items.values()]
+
+    def maybe_flush(self):
+        """Flush the items that are due; returns the seconds until the next one is, or None."""
+        delays = [delay for delay in (entry[2].maybe_flush() for entry in self._items.values()) if delay is not None]
+        return min(delays, default=None)
+
+    def flush(self):
+        """Render every item that has pending changes."""
+        for entry in self._items.values():
+            entry[2].flush()
+
+    def clear(self):
+        """Empty all placeholders and forget the items."""
+        for entry in self._items.values():
+            entry[1].empty()
+        self._items.clear()
@@ -12,198 +12,32 @@
 
 import streamlit as st
 
-import os
+from static_assets import image_asset, inline_css, small_image
 
 
 # Configure Streamlit page with favicon
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-PUBLIC_DIR = os.path.join(BASE_DIR, "public")
-
 st.set_page_config(
     page_title="Tropical Forages Chat",
-    page_icon=os.path.join(PUBLIC_DIR, "grass.png"),
+    page_icon=small_image("grass.png", 64),
     layout="wide",
     initial_sidebar_state="expanded",
     menu_items={
     }
 )
 
-# Apply custom CSS for background and light theme
-st.markdown("""
-<style>
-            
-    /* Make chat and markdown more mobile-friendly */
-    .stChatMessage, .stMarkdown, .stTextInput, .stButton, .stTextArea {
-        max-width: 100vw !important;
-        word-break: break-word;
-        font-size: 1.05em;
-    }
-    /* Remove horizontal scroll on mobile */
-    .block-container { padding-left: 0.5rem; padding-right: 0.5rem; }
-    @media (max-width: 600px) {
-        .stChatMessage, .stMarkdown, .stTextInput, .stButton, .stTextArea {
-            font-size: 1.15em;
-        }
-        .block-container { padding-left: 0.2rem; padding-right: 0.2rem; }
-    }
-            
-    /* Set light theme colors */
-    :root {
-        --background-color: #ffffff;
-        --text-color: #1a1a1a;
-        --secondary-bg: #f8f9fa;
-        --border-color: #e1e4e8;
-    }
-    
-    /* Main app background with gradient */
-    .stApp {
-        background-color: #fff;
-        background-image: 
-            radial-gradient(at 21% 11%, hsl(126.83deg 57% 78% / 52%) 0, transparent 50%), 
-            radial-gradient(at 85% 0, rgb(233 230 186 / 53%) 0, transparent 50%), 
-            radial-gradient(at 91% 36%, rgb(212 255 194 / 68%) 0, transparent 50%), 
-            radial-gradient(at 8% 40%, rgb(239 251 218 / 46%) 0, transparent 50%);
-    }
-    
-    /* Sidebar styling */
-    .css-1d391kg {
-        background-color: rgba(255, 255, 255, 0.9);
-        backdrop-filter: blur(10px);
-    }
-    
-    /* Chat message styling */
-    .stChatMessage {
-        background-color: rgba(255, 255, 255, 0.8);
-        backdrop-filter: blur(5px);
-        border-radius: 10px;
-        border: 1px solid rgba(225, 228, 232, 0.5);
-    }
-    
-    /* Input styling */
-    .stTextInput > div > div > input {
-        background-color: rgba(255, 255, 255, 0.9);
-        border: 1px solid #e1e4e8;
-        border-radius: 8px;
-    }
-    
-    /* Button styling */
-    .stButton > button {
-        background-color: rgba(255, 255, 255, 0.9);
-        border: 1px solid #e1e4e8;
-        border-radius: 8px;
-        color: #1a1a1a;
-    }
-    
-    .stButton > button:hover {
-        background-color: rgba(248, 249, 250, 0.9);
-        border-color: #d1d5da;
-    }
-    
-    /* Metrics and info boxes */
-    .metric-container {
-        background-color: rgba(255, 255, 255, 0.8);
-        backdrop-filter: blur(5px);
-        border-radius: 10px;
-        border: 1px solid rgba(225, 228, 232, 0.5);
-        padding: 1rem;
-    }
-    
-    /* Force light theme for code blocks */
-    .stCodeBlock {
-        background-color: rgba(248, 249, 250, 0.9) !important;
-    }
-    
-    /* Custom header styling */
-    .chat-header {
-        background: linear-gradient(90deg, #28a745, #20c997);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-        font-size: 2.5rem;
-        font-weight: bold;
-        text-align: center;
-        margin-bottom: 2rem;
-    }
-    
-    /* Constrain main content to 80% width */
-    .block-container {
-        max-width: 60% !important;
-        margin: 0 auto !important;
-        padding-left: 2rem !important;
-        padding-right: 2rem !important;
-    }
-    
-    /* Alternative selector for content width constraint */
-    [data-testid="stAppViewContainer"] > .main > .block-container {
-        max-width: 60% !important;
-        margin: 0 auto !important;
-    }
-    
-    /* Make chat input full width like header */
-    [data-testid="stChatInput"] {
-        max-width: 60% !important;
-        width: 60% !important;
-        left: 20% !important;
-        transform: none !important;
-    }
-    
-    /* Chat input container full width */
-    .stChatInput > div {
-        max-width: 100% !important;
-        width: 100% !important;
-    }
-    
-    /* Alternative chat input selectors */
-    [data-testid="stBottom"] > div {
-        max-width: 100% !important;
-        width: 100% !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+# Apply custom CSS for background and light theme (minified once per process)
+st.markdown(inline_css("app.css"), unsafe_allow_html=True)
 
 # --- Init state ---
 if "history" not in st.session_state:
     st.session_state.history = []
 
-# Simple header with title, paragraph and logos - HTML only
-import base64
-
-# Load images and convert to base64
-with open(os.path.join(PUBLIC_DIR, "headerv2.jpg"), "rb") as f:
-    header_img = base64.b64encode(f.read()).decode()
-with open(os.path.join(PUBLIC_DIR, "logo.png"), "rb") as f:
-    logo_img = base64.b64encode(f.read()).decode()
+# Simple header with title, paragraph and logos - HTML only.
+# Images are resized, hashed and served from app/static (see static_assets.py)
+header_img = image_asset("headerv2.jpg", 80)
+logo_img = image_asset("logo.png", 200)
 
 st.markdown(f"""
-<style>
-@media (max-width: 1500px) {{
-    .responsive-header {{
-        flex-direction: column !important;
-        align-items: stretch !important;
-        text-align: center !important;
-        gap: 1.2rem !important;
-    }}
-    .responsive-header .header-left, .responsive-header .header-right {{
-        flex: unset !important;
-        width: 100% !important;
-        justify-content: center !important;
-        align-items: center !important;
-    }}
-    .responsive-header h1 {{
-        font-size: 1.2rem !important;
-    }}
-    .responsive-header p {{
-        font-size: 0.95rem !important;
-    }}
-    .responsive-header img {{
-        height: 60px !important;
-        max-width: 90vw !important;
-    }}
-    .responsive-header .logo-img {{
-        height: 100px !important;
-    }}
-}}
-</style>
 <div class="responsive-header" style="display: flex; justify-content: space-between; align-items: center; padding: 20px 0; margin-bottom: 2rem; gap: 2rem;">
         <div class="header-left" style="flex: 0.7; min-width: 0;">
                 <h1 style="color: #28a745; font-size: 1.0rem; font-weight: bold; margin: 0;">
@@ -215,15 +49,19 @@ st.markdown(f"""
         </div>
         <div class="header-right" style="display: flex; gap: 15px; align-items: center; flex-shrink: 0; min-width: 0;">
                 <a href="https://tropicalforages.info/text/intro/index.html" target="_blank" style="text-decoration: none;">
-                        <img src="data:image/jpeg;base64,{header_img}" style="height: 80px; border-radius: 8px; cursor: pointer; transition: opacity 0.3s ease;" onmouseover="this.style.opacity='0.8'" onmouseout="this.style.opacity='1'">
+                        <img src="{header_img.src}" srcset="{header_img.srcset}" alt="Tropical Forages" style="height: 80px; border-radius: 8px; cursor: pointer; transition: opacity 0.3s ease;" onmouseover="this.style.opacity='0.8'" onmouseout="this.style.opacity='1'">
                 </a>
-                <img class="logo-img" src="data:image/png;base64,{logo_img}" style="height: 200px;">
+                <img class="logo-img" src="{logo_img.src}" srcset="{logo_img.srcset}" alt="Logo" style="height: 200px;">
         </div>
 </div>
 """, unsafe_allow_html=True)
 
+# --- Chat input (must run BEFORE rendering messages) ---
+# Created right after the header so it is painted before anything slow runs;
+# Streamlit pins it to the bottom of the page wherever it is created
+prompt = st.chat_input("Ask a question")
+
 import logging
-import os
 from model_serving_utils import (
     endpoint_supports_feedback, 
     query_endpoint, 
@@ -231,63 +69,42 @@ from model_serving_utils import (
     _get_endpoint_task_type,
 )
 from collections import OrderedDict
-from messages import UserMessage, AssistantResponse, render_message
+import functools
+import uuid
+from messages import ASSISTANT_AVATAR, INCOMPLETE_ANSWER_NOTICE, Message, UserMessage, AssistantResponse, render_history, render_message
+from stream_render import KeyedStreamRenderer, StreamRenderBuffer
+from stream_reducers import ChatAgentMessageAccumulator, ResponsesOutputTextAccumulator
+from stream_parsers import parse_chat_agent_chunk, parse_responses_event
+from context_builder import ContextBuilder
+from response_cache import cache_response, get_cached_response
+from semantic_cache import add_semantic_entry, get_semantic_match
+from app_config import load_config
+from retry_policy import UNSUPPORTED, classify_error, stream_retry_policy
+from deadlines import Deadline
+from metrics import TurnMetrics, start_metrics_exporters
+from streamlit.runtime.scriptrunner import RerunException, StopException
+from admission import AdmissionRejected
+from warm_start import start_warm_start
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# --- DEBUG SECTION: Show config and secrets status in the UI ---
-# (Moved here so variables are defined)
+# Per-session so the summary of dropped turns is cached across reruns
+if "context_builder" not in st.session_state:
+    st.session_state.context_builder = ContextBuilder()
 
-# Try to get configuration from environment variables first, then Streamlit secrets
-SERVING_ENDPOINT = os.getenv('SERVING_ENDPOINT')
-DATABRICKS_HOST = os.getenv('DATABRICKS_HOST')
-DATABRICKS_TOKEN = os.getenv('DATABRICKS_TOKEN')
+# Resolved once per process (and again only when a secrets file changes)
+config = load_config()
+SERVING_ENDPOINT = config.serving_endpoint
+DATABRICKS_HOST = config.databricks_host
+DATABRICKS_TOKEN = config.databricks_token
 
-# If not found in environment, try Streamlit secrets
-if not SERVING_ENDPOINT or not DATABRICKS_HOST or not DATABRICKS_TOKEN:
-    try:
-        # Debug: Show what we're trying to read
-        logger.info("Trying to read from Streamlit secrets...")
-        
-        if hasattr(st, 'secrets'):
-            logger.info("Streamlit secrets are available")
-            if not SERVING_ENDPOINT:
-                try:
-                    SERVING_ENDPOINT = st.secrets["SERVING_ENDPOINT"]
-                    logger.info(f"Got SERVING_ENDPOINT from secrets: {'***' if SERVING_ENDPOINT else 'None'}")
-                except KeyError:
-                    logger.warning("SERVING_ENDPOINT not found in secrets")
-            if not DATABRICKS_HOST:
-                try:
-                    DATABRICKS_HOST = st.secrets["DATABRICKS_HOST"]
-                    logger.info(f"Got DATABRICKS_HOST from secrets: {'***' if DATABRICKS_HOST else 'None'}")
-                except KeyError:
-                    logger.warning("DATABRICKS_HOST not found in secrets")
-            if not DATABRICKS_TOKEN:
-                try:
-                    DATABRICKS_TOKEN = st.secrets["DATABRICKS_TOKEN"]
-                    logger.info(f"Got DATABRICKS_TOKEN from secrets: {'***' if DATABRICKS_TOKEN else 'None'}")
-                except KeyError:
-                    logger.warning("DATABRICKS_TOKEN not found in secrets")
-            # Debug: Show available secrets
-            try:
-                available_secrets = list(st.secrets.keys())
-                logger.info(f"Available secrets: {available_secrets}")
-            except Exception as e:
-                logger.warning(f"Could not list secrets: {e}")
-        else:
-            logger.warning("Streamlit secrets not available")
-            
-        # Set environment variables for databricks-sdk
-        if DATABRICKS_HOST:
-            os.environ['DATABRICKS_HOST'] = DATABRICKS_HOST
-        if DATABRICKS_TOKEN:
-            os.environ['DATABRICKS_TOKEN'] = DATABRICKS_TOKEN
-            
-    except Exception as e:
-        logger.error(f"Error reading from Streamlit secrets: {e}")
-        st.error(f"Error reading secrets: {e}")
+# Once per process: /metrics server (if METRICS_PORT is set) and periodic metric log lines
+start_metrics_exporters()
+
+# Once per process: import the Databricks SDK and MLflow and build the clients in
+# the background, after load_config() has exported the credentials they read
+start_warm_start()
 
 # # --- DEBUG SECTION: Show config and secrets status in the UI ---
 # with st.expander('🛠️ Debug: Configuration & Secrets', expanded=True):
@@ -304,55 +121,6 @@ if not SERVING_ENDPOINT or not DATABRICKS_HOST or not DATABRICKS_TOKEN:
 #         st.write(list(st.secrets.keys()))
 #     except Exception as e:
 #         st.write(f"Could not access st.secrets: {e}")
-# Try to get configuration from environment variables first, then Streamlit secrets
-SERVING_ENDPOINT = os.getenv('SERVING_ENDPOINT')
-DATABRICKS_HOST = os.getenv('DATABRICKS_HOST')
-DATABRICKS_TOKEN = os.getenv('DATABRICKS_TOKEN')
-
-# If not found in environment, try Streamlit secrets
-if not SERVING_ENDPOINT or not DATABRICKS_HOST or not DATABRICKS_TOKEN:
-    try:
-        # Debug: Show what we're trying to read
-        logger.info("Trying to read from Streamlit secrets...")
-        
-        if hasattr(st, 'secrets'):
-            logger.info("Streamlit secrets are available")
-            if not SERVING_ENDPOINT:
-                try:
-                    SERVING_ENDPOINT = st.secrets["SERVING_ENDPOINT"]
-                    logger.info(f"Got SERVING_ENDPOINT from secrets: {'***' if SERVING_ENDPOINT else 'None'}")
-                except KeyError:
-                    logger.warning("SERVING_ENDPOINT not found in secrets")
-            if not DATABRICKS_HOST:
-                try:
-                    DATABRICKS_HOST = st.secrets["DATABRICKS_HOST"]
-                    logger.info(f"Got DATABRICKS_HOST from secrets: {'***' if DATABRICKS_HOST else 'None'}")
-                except KeyError:
-                    logger.warning("DATABRICKS_HOST not found in secrets")
-            if not DATABRICKS_TOKEN:
-                try:
-                    DATABRICKS_TOKEN = st.secrets["DATABRICKS_TOKEN"]
-                    logger.info(f"Got DATABRICKS_TOKEN from secrets: {'***' if DATABRICKS_TOKEN else 'None'}")
-                except KeyError:
-                    logger.warning("DATABRICKS_TOKEN not found in secrets")
-            # Debug: Show available secrets
-            try:
-                available_secrets = list(st.secrets.keys())
-                logger.info(f"Available secrets: {available_secrets}")
-            except Exception as e:
-                logger.warning(f"Could not list secrets: {e}")
-        else:
-            logger.warning("Streamlit secrets not available")
-            
-        # Set environment variables for databricks-sdk
-        if DATABRICKS_HOST:
-            os.environ['DATABRICKS_HOST'] = DATABRICKS_HOST
-        if DATABRICKS_TOKEN:
-            os.environ['DATABRICKS_TOKEN'] = DATABRICKS_TOKEN
-            
-    except Exception as e:
-        logger.error(f"Error reading from Streamlit secrets: {e}")
-        st.error(f"Error reading secrets: {e}")
 
 # Check if we have the required configuration
 if not SERVING_ENDPOINT:
@@ -374,8 +142,8 @@ if not SERVING_ENDPOINT:
     """)
     st.stop()
 
-if not DATABRICKS_HOST or not DATABRICKS_TOKEN:
-    st.error("❌ **Missing Databricks Authentication**")
+if config.auth_problems():
+    st.error("❌ **Missing Databricks Authentication**: " + "; ".join(config.auth_problems()))
     st.info("""
     **Required secrets:**
     - `DATABRICKS_HOST`: Your Databricks workspace URL
@@ -409,219 +177,436 @@ except Exception as e:
 
 
 
-def reduce_chat_agent_chunks(chunks):
-    """
-    Reduce a list of ChatAgentChunk objects corresponding to a particular
-    message into a single ChatAgentMessage
-    """
-    deltas = [chunk.delta for chunk in chunks]
-    first_delta = deltas[0]
-    result_msg = first_delta
-    msg_contents = []
-    
-    # Accumulate tool calls properly
-    tool_call_map = {}  # Map call_id to tool call for accumulation
-    
-    for delta in deltas:
-        # Handle content
-        if delta.content:
-            msg_contents.append(delta.content)
-            
-        # Handle tool calls
-        if hasattr(delta, 'tool_calls') and delta.tool_calls:
-            for tool_call in delta.tool_calls:
-                call_id = getattr(tool_call, 'id', None)
-                tool_type = getattr(tool_call, 'type', "function")
-                function_info = getattr(tool_call, 'function', None)
-                if function_info:
-                    func_name = getattr(function_info, 'name', "")
-                    func_args = getattr(function_info, 'arguments', "")
-                else:
-                    func_name = ""
-                    func_args = ""
-                
-                if call_id:
-                    if call_id not in tool_call_map:
-                        # New tool call
-                        tool_call_map[call_id] = {
-                            "id": call_id,
-                            "type": tool_type,
-                            "function": {
-                                "name": func_name,
-                                "arguments": func_args
-                            }
-                        }
-                    else:
-                        # Accumulate arguments for existing tool call
-                        existing_args = tool_call_map[call_id]["function"]["arguments"]
-                        tool_call_map[call_id]["function"]["arguments"] = existing_args + func_args
-
-                        # Update function name if provided
-                        if func_name:
-                            tool_call_map[call_id]["function"]["name"] = func_name
-
-        # Handle tool call IDs (for tool response messages)
-        if hasattr(delta, 'tool_call_id') and delta.tool_call_id:
-            result_msg = result_msg.model_copy(update={"tool_call_id": delta.tool_call_id})
-    
-    # Convert tool call map back to list
-    if tool_call_map:
-        accumulated_tool_calls = list(tool_call_map.values())
-        result_msg = result_msg.model_copy(update={"tool_calls": accumulated_tool_calls})
-    
-    result_msg = result_msg.model_copy(update={"content": "".join(msg_contents)})
-    return result_msg
-
+# Identifies this browser session to the endpoint admission queue, so
+# concurrent users are served in turn
+if "admission_session_id" not in st.session_state:
+    st.session_state.admission_session_id = uuid.uuid4().hex
+SESSION_ID = st.session_state.admission_session_id
 
 # --- Render chat history ---
-for i, element in enumerate(st.session_state.history):
-    element.render(i)
+render_history(st.session_state.history)
 
 def query_endpoint_and_render(task_type, input_messages):
     """Handle streaming response based on task type."""
-    if task_type == "agent/v1/responses":
-        return query_responses_endpoint_and_render(input_messages)
-    elif task_type == "agent/v2/chat":
-        return query_chat_agent_endpoint_and_render(input_messages)
-    else:  # chat/completions
-        return query_chat_completions_endpoint_and_render(input_messages)
+    turn = TurnMetrics(task_type)
+    cached_messages = get_cached_response(SERVING_ENDPOINT, task_type, input_messages)
+    if cached_messages is None:
+        # Paraphrases of earlier first-turn questions
+        cached_messages = get_semantic_match(SERVING_ENDPOINT, task_type, input_messages)
+    if cached_messages is not None:
+        response = render_cached_response(cached_messages)
+        turn.finish("cached")
+        return response
 
+    try:
+        if task_type == "agent/v1/responses":
+            response = query_responses_endpoint_and_render(task_type, input_messages, turn)
+        elif task_type == "agent/v2/chat":
+            response = query_chat_agent_endpoint_and_render(task_type, input_messages, turn)
+        else:  # chat/completions
+            response = query_chat_completions_endpoint_and_render(task_type, input_messages, turn)
+    except (RerunException, StopException):
+        turn.finish("interrupted")
+        raise
+    turn.finish("failed" if response is None else "complete" if response.complete else "partial")
+
+    if response is None or not response.complete:
+        return response
+
+    # Only keep answers that actually say something
+    if any(msg.get("role") == "assistant" and msg.get("content") for msg in response.messages):
+        cache_response(SERVING_ENDPOINT, task_type, input_messages, response.messages)
+        add_semantic_entry(SERVING_ENDPOINT, task_type, input_messages, response.messages)
+    return response
+
+
+def render_cached_response(messages):
+    """Replay a cached answer without calling the endpoint."""
+    with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
+        for message in messages:
+            render_message(message)
+    # The original request id belongs to another conversation, so no feedback
+    return AssistantResponse(messages=messages, request_id=None)
+
+
+def _render_stream_controls():
+    """
+    Show a "Stop generating" button and a waiting indicator under a streaming answer.
 
-def query_chat_completions_endpoint_and_render(input_messages):
+    Returns the placeholder holding them (empty it once the stream ends) and
+    the on_wait and on_queue callbacks for query_endpoint_stream. Clicking the
+    button makes Streamlit rerun the script, which interrupts this run at its
+    next element update; updating the indicator while nothing arrives (or
+    while queued behind other users) makes sure such an update happens.
+    """
+    controls_area = st.empty()
+    with controls_area.container():
+        st.button("⏹️ Stop generating", key="stop_generating")
+        wait_status = st.empty()
+
+    def on_wait(waited):
+        if waited is None:
+            wait_status.empty()
+        else:
+            wait_status.caption(f"Waiting for the endpoint... {waited:.0f}s")
+
+    def on_queue(position, estimated_wait):
+        if position is None:
+            wait_status.empty()
+        else:
+            wait_status.caption(_queue_message(position, estimated_wait))
+    return controls_area, on_wait, on_queue
+
+
+def _queue_message(position, estimated_wait):
+    return (f"🚦 Many people are asking right now. You are number {position} in line "
+            f"(about {max(1, round(estimated_wait))}s).")
+
+
+def _keep_interrupted_answer(partial_messages, request_id):
+    """Keep what was streamed before the run was interrupted (Stop generating or a new prompt)."""
+    if partial_messages:
+        st.session_state.history.append(
+            AssistantResponse(messages=partial_messages, request_id=request_id, complete=False)
+        )
+
+
+def _recover_from_stream_error(error, task_type, input_messages, response_area, partial_messages, request_id,
+                               deadline=None, turn=None):
+    """
+    Decide what to show once streaming failed for good (retries included).
+
+    The answer is only regenerated with a blocking call when the endpoint
+    can't stream at all; otherwise whatever was already streamed is kept and
+    marked as incomplete, or an error is shown if nothing arrived.
+    """
+    if classify_error(error) == UNSUPPORTED:
+        logger.info(f"Streaming not supported by {SERVING_ENDPOINT}, querying without streaming: {error}")
+        response_area.markdown("_Waiting for the full answer..._")
+        if turn is not None:
+            turn.fallback()
+
+        def on_queue(position, estimated_wait):
+            # The stream controls are gone by now, so the queue status goes in the answer's place
+            if position is None:
+                response_area.markdown("_Waiting for the full answer..._")
+            else:
+                response_area.caption(_queue_message(position, estimated_wait))
+        try:
+            messages, request_id = query_endpoint(
+                endpoint_name=SERVING_ENDPOINT,
+                messages=input_messages,
+                return_traces=ENDPOINT_SUPPORTS_FEEDBACK,
+                task_type=task_type,
+                deadline=deadline,
+                session_id=SESSION_ID,
+                on_queue=on_queue
+            )
+        except AdmissionRejected as e:
+            logger.warning(f"Query to {SERVING_ENDPOINT} not admitted: {e}")
+            response_area.warning("🚦 The assistant is very busy right now. Please try again in a minute.")
+            return None
+        except TimeoutError as e:
+            logger.error(f"Query to {SERVING_ENDPOINT} timed out: {e}")
+            response_area.error("⏱️ The endpoint took too long to answer. Please try again.")
+            return None
+        response_area.empty()
+        with response_area.container():
+            for message in messages:
+                render_message(message)
+        return AssistantResponse(messages=messages, request_id=request_id)
+
+    logger.error(f"Streaming from {SERVING_ENDPOINT} failed: {error}")
+    if not partial_messages:
+        if isinstance(error, AdmissionRejected):
+            response_area.warning("🚦 The assistant is very busy right now. Please try again in a minute.")
+        elif isinstance(error, TimeoutError):
+            response_area.error("⏱️ The endpoint took too long to answer. Please try again.")
+        else:
+            response_area.error("❌ Could not get an answer from the endpoint. Please try again.")
+        return None
+    response_area.empty()
+    with response_area.container():
+        for message in partial_messages:
+            render_message(message)
+        st.caption(INCOMPLETE_ANSWER_NOTICE)
+    return AssistantResponse(messages=partial_messages, request_id=request_id, complete=False)
+
+
+def query_chat_completions_endpoint_and_render(task_type, input_messages, turn):
     """Handle ChatCompletions streaming format."""
-    with st.chat_message("assistant", avatar="public/grass.png"):
+    with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
         response_area = st.empty()
         response_area.markdown("_Thinking..._")
         
-        accumulated_content = ""
+        # Coalesce deltas so the growing answer isn't re-sent on every token
+        render_buffer = StreamRenderBuffer(response_area.markdown)
         request_id = None
+        # What an interrupted earlier attempt had streamed, kept in case the retries fail too
+        previous_attempt = ([], None)
+
+        def partial_messages():
+            return [{"role": "assistant", "content": render_buffer.text}] if render_buffer.text else []
+
+        def restart(attempt, error):
+            # A reopened stream regenerates the answer from the start
+            nonlocal render_buffer, request_id, previous_attempt
+            if render_buffer.text:
+                previous_attempt = (partial_messages(), request_id)
+            render_buffer = StreamRenderBuffer(response_area.markdown)
+            request_id = None
+            response_area.markdown("_Connection interrupted, retrying..._")
+            turn.retry()
         
-        try:
-            for chunk in query_endpoint_stream(
+        controls_area, on_wait, on_queue = _render_stream_controls()
+        deadline = Deadline()
+        chunks = stream_retry_policy.stream(
+            lambda: query_endpoint_stream(
                 endpoint_name=SERVING_ENDPOINT,
                 messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            ):
+                return_traces=ENDPOINT_SUPPORTS_FEEDBACK,
+                task_type=task_type,
+                deadline=deadline,
+                on_wait=on_wait,
+                session_id=SESSION_ID,
+                on_queue=on_queue,
+                # Render what is pending as soon as the reader has nothing more queued
+                # Coalesced: renders only once the flush interval or size is reached
+                on_drained=lambda: render_buffer.maybe_flush()
+            ),
+            on_retry=restart,
+            deadline=deadline
+        )
+        try:
+            for chunk in chunks:
+                turn.chunk()
                 if "choices" in chunk and chunk["choices"]:
                     delta = chunk["choices"][0].get("delta", {})
                     content = delta.get("content", "")
                     if content:
-                        accumulated_content += content
-                        response_area.markdown(accumulated_content)
+                        render_buffer.append(content)
+                        turn.content(len(content.encode("utf-8")))
                 
                 if "databricks_output" in chunk:
                     req_id = chunk["databricks_output"].get("databricks_request_id")
                     if req_id:
                         request_id = req_id
             
+            render_buffer.flush()
+            controls_area.empty()
             return AssistantResponse(
-                messages=[{"role": "assistant", "content": accumulated_content}],
+                messages=[{"role": "assistant", "content": render_buffer.text}],
                 request_id=request_id
             )
-        except Exception:
-            response_area.markdown("_Ran into an error. Retrying without streaming..._")
-            messages, request_id = query_endpoint(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            )
-            response_area.empty()
-            with response_area.container():
-                for message in messages:
-                    render_message(message)
-            return AssistantResponse(messages=messages, request_id=request_id)
-
-
-def query_chat_agent_endpoint_and_render(input_messages):
+        except (RerunException, StopException):
+            _keep_interrupted_answer(*((partial_messages(), request_id) if render_buffer.text else previous_attempt))
+            raise
+        except Exception as e:
+            controls_area.empty()
+            render_buffer.flush()
+            messages, req_id = (partial_messages(), request_id) if render_buffer.text else previous_attempt
+            return _recover_from_stream_error(e, task_type, input_messages, response_area, messages, req_id, deadline, turn)
+        finally:
+            # Cancels the upstream request if the stream did not run to the end
+            chunks.close()
+
+
+def _partial_chat_agent_message_renderer(accumulator, render_area):
+    """Build a render callback that draws the partial ChatAgent message of an accumulator."""
+    def render(_):
+        with render_area.container():
+            render_message(accumulator.message())
+    return render
+
+
+def query_chat_agent_endpoint_and_render(task_type, input_messages, turn):
     """Handle ChatAgent streaming format."""
-    from mlflow.types.agent import ChatAgentChunk
-    
-    with st.chat_message("assistant", avatar="public/grass.png"):
-        response_area = st.empty()
+    with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
+        # Messages go in here, above the stream controls
+        body = st.container()
+        response_area = body.empty()
         response_area.markdown("_Thinking..._")
         
         message_buffers = OrderedDict()
         request_id = None
+        previous_attempt = ([], None)
+
+        def partial_messages():
+            return [msg_info["accumulator"].message() for msg_info in message_buffers.values()]
+
+        def restart(attempt, error):
+            # A reopened stream regenerates the messages from the start
+            nonlocal request_id, previous_attempt
+            if message_buffers:
+                previous_attempt = (partial_messages(), request_id)
+            for msg_info in message_buffers.values():
+                msg_info["placeholder"].empty()
+            message_buffers.clear()
+            request_id = None
+            response_area.markdown("_Connection interrupted, retrying..._")
+            turn.retry()
+
+        def flush_pending():
+            for msg_info in message_buffers.values():
+                msg_info["render_buffer"].flush()
+
+        def flush_due():
+            # Flush the messages that are due; seconds until the next one is, or None
+            delays = [msg_info["render_buffer"].maybe_flush() for msg_info in message_buffers.values()]
+            return min((delay for delay in delays if delay is not None), default=None)
         
-        try:
-            for raw_chunk in query_endpoint_stream(
+        controls_area, on_wait, on_queue = _render_stream_controls()
+        deadline = Deadline()
+        chunks = stream_retry_policy.stream(
+            lambda: query_endpoint_stream(
                 endpoint_name=SERVING_ENDPOINT,
                 messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            ):
-                response_area.empty()
-                chunk = ChatAgentChunk.model_validate(raw_chunk)
-                delta = chunk.delta
-                message_id = delta.id
+                return_traces=ENDPOINT_SUPPORTS_FEEDBACK,
+                task_type=task_type,
+                deadline=deadline,
+                on_wait=on_wait,
+                session_id=SESSION_ID,
+                on_queue=on_queue,
+                # Parsed on the reader thread, off the render loop
+                parse=parse_chat_agent_chunk,
+                on_drained=flush_due
+            ),
+            on_retry=restart,
+            deadline=deadline
+        )
+        try:
+            for raw_chunk, delta in chunks:
+                turn.chunk()
+                # A raw delta dict (see stream_parsers.py)
+                message_id = delta["id"]
 
                 req_id = raw_chunk.get("databricks_output", {}).get("databricks_request_id")
                 if req_id:
                     request_id = req_id
                 if message_id not in message_buffers:
+                    if not message_buffers:
+                        response_area.empty()
+                    accumulator = ChatAgentMessageAccumulator()
+                    placeholder = body.empty()
                     message_buffers[message_id] = {
-                        "chunks": [],
-                        "render_area": st.empty(),
+                        "accumulator": accumulator,
+                        "placeholder": placeholder,
+                        "render_buffer": StreamRenderBuffer(
+                            _partial_chat_agent_message_renderer(accumulator, placeholder)
+                        ),
                     }
-                message_buffers[message_id]["chunks"].append(chunk)
-                
-                partial_message = reduce_chat_agent_chunks(message_buffers[message_id]["chunks"])
-                render_area = message_buffers[message_id]["render_area"]
-                message_content = partial_message.model_dump_compat(exclude_none=True)
-                with render_area.container():
-                    render_message(message_content)
-            
-            messages = []
-            for msg_id, msg_info in message_buffers.items():
-                messages.append(reduce_chat_agent_chunks(msg_info["chunks"]))
+                nbytes = len((delta.get("content") or "").encode("utf-8"))
+                message_buffers[message_id]["accumulator"].add(delta)
+                message_buffers[message_id]["render_buffer"].mark_dirty(nbytes)
+                if nbytes:
+                    turn.content(nbytes)
             
-            return AssistantResponse(
-                messages=[message.model_dump_compat(exclude_none=True) for message in messages],
-                request_id=request_id
-            )
-        except Exception:
-            response_area.markdown("_Ran into an error. Retrying without streaming..._")
-            messages, request_id = query_endpoint(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            )
-            response_area.empty()
-            with response_area.container():
-                for message in messages:
-                    render_message(message)
-            return AssistantResponse(messages=messages, request_id=request_id)
-
-
-def query_responses_endpoint_and_render(input_messages):
+            flush_pending()
+            controls_area.empty()
+            return AssistantResponse(messages=partial_messages(), request_id=request_id)
+        except (RerunException, StopException):
+            _keep_interrupted_answer(*((partial_messages(), request_id) if message_buffers else previous_attempt))
+            raise
+        except Exception as e:
+            controls_area.empty()
+            messages, req_id = (partial_messages(), request_id) if message_buffers else previous_attempt
+            for msg_info in message_buffers.values():
+                msg_info["placeholder"].empty()
+            return _recover_from_stream_error(e, task_type, input_messages, response_area, messages, req_id, deadline, turn)
+        finally:
+            chunks.close()
+
+
+def _render_messages_into(placeholder, messages):
+    """Replace the contents of a placeholder with the given messages (or a callable producing them)."""
+    if callable(messages):
+        messages = messages()
+    with placeholder.container():
+        for msg in messages:
+            render_message(msg)
+
+
+def query_responses_endpoint_and_render(task_type, input_messages, turn):
     """Handle ResponsesAgent streaming format using MLflow types."""
-    from mlflow.types.responses import ResponsesAgentStreamEvent
-    
-    with st.chat_message("assistant", avatar="public/grass.png"):
-        response_area = st.empty()
+    with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
+        # Output items go in here, above the stream controls
+        body = st.container()
+        response_area = body.empty()
         response_area.markdown("_Thinking..._")
         
-        # Track all the messages that need to be rendered in order
-        all_messages = []
+        # Each output item gets its own placeholder the first time it shows up,
+        # so a new or updated item never re-renders the ones before it
+        item_views = KeyedStreamRenderer(body.empty, _render_messages_into)
+        # Text streamed through output_text delta events, keyed by item id
+        output_text = ResponsesOutputTextAccumulator()
         request_id = None
-
-        try:
-            for raw_event in query_endpoint_stream(
+        previous_attempt = ([], None)
+
+        def partial_messages():
+            return [
+                msg for item_messages in item_views.values()
+                for msg in (item_messages() if callable(item_messages) else item_messages)
+            ]
+
+        def restart(attempt, error):
+            # A reopened stream regenerates every output item from the start
+            nonlocal output_text, request_id, previous_attempt
+            if item_views:
+                previous_attempt = (partial_messages(), request_id)
+            item_views.clear()
+            output_text = ResponsesOutputTextAccumulator()
+            request_id = None
+            response_area.markdown("_Connection interrupted, retrying..._")
+            turn.retry()
+
+        controls_area, on_wait, on_queue = _render_stream_controls()
+        deadline = Deadline()
+        chunks = stream_retry_policy.stream(
+            lambda: query_endpoint_stream(
                 endpoint_name=SERVING_ENDPOINT,
                 messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            ):
+                return_traces=ENDPOINT_SUPPORTS_FEEDBACK,
+                task_type=task_type,
+                deadline=deadline,
+                on_wait=on_wait,
+                session_id=SESSION_ID,
+                on_queue=on_queue,
+                parse=parse_responses_event,
+                on_drained=item_views.maybe_flush
+            ),
+            on_retry=restart,
+            deadline=deadline
+        )
+        try:
+            for raw_event in chunks:
+                turn.chunk()
                 # Extract databricks_output for request_id
                 if "databricks_output" in raw_event:
                     req_id = raw_event["databricks_output"].get("databricks_request_id")
                     if req_id:
                         request_id = req_id
                 
-                # Parse using MLflow streaming event types, similar to ChatAgentChunk
+                # Validated against the MLflow event types by parse_responses_event
                 if "type" in raw_event:
-                    event = ResponsesAgentStreamEvent.model_validate(raw_event)
+                    if raw_event["type"] == "response.output_text.delta":
+                        # Render text as it is generated instead of waiting for the final item
+                        item_id = raw_event.get("item_id")
+                        delta = raw_event.get("delta") or ""
+                        if delta:
+                            if not item_views:
+                                response_area.empty()
+                            nbytes = len(delta.encode("utf-8"))
+                            output_text.add(item_id, delta)
+                            item_views.update(
+                                ("message", item_id),
+                                functools.partial(output_text.messages, item_id),
+                                nbytes
+                            )
+                            turn.content(nbytes)
                     
-                    if hasattr(event, 'item') and event.item:
-                        item = event.item  # This is a dict, not a parsed object
+                    elif raw_event.get("item"):
+                        item = raw_event["item"]
+                        item_messages = []
                         
                         if item.get("type") == "message":
                             # Extract text content from message if present
@@ -630,7 +615,7 @@ def query_responses_endpoint_and_render(input_messages):
                                 if content_part.get("type") == "output_text":
                                     text = content_part.get("text", "")
                                     if text:
-                                        all_messages.append({
+                                        item_messages.append({
                                             "role": "assistant",
                                             "content": text
                                         })
@@ -642,7 +627,7 @@ def query_responses_endpoint_and_render(input_messages):
                             arguments = item.get("arguments", "")
                             
                             # Add to messages for history
-                            all_messages.append({
+                            item_messages.append({
                                 "role": "assistant",
                                 "content": "",
                                 "tool_calls": [{
@@ -661,37 +646,49 @@ def query_responses_endpoint_and_render(input_messages):
                             output = item.get("output", "")
                             
                             # Add to messages for history
-                            all_messages.append({
+                            item_messages.append({
                                 "role": "tool",
                                 "content": output,
                                 "tool_call_id": call_id
                             })
-                
-                # Update the display by rendering all accumulated messages
-                if all_messages:
-                    with response_area.container():
-                        for msg in all_messages:
-                            render_message(msg)
-
-            return AssistantResponse(messages=all_messages, request_id=request_id)
-        except Exception:
-            response_area.markdown("_Ran into an error. Retrying without streaming..._")
-            messages, request_id = query_endpoint(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            )
-            response_area.empty()
-            with response_area.container():
-                for message in messages:
-                    render_message(message)
-            return AssistantResponse(messages=messages, request_id=request_id)
-
-
-
-
-# --- Chat input (must run BEFORE rendering messages) ---
-prompt = st.chat_input("Ask a question")
+                        
+                        if item.get("type") == "message":
+                            # Replace text already streamed for this item with the final payload
+                            item_key = ("message", output_text.finish(item.get("id")))
+                        else:
+                            # function_call and function_call_output share a call_id, so key on type too
+                            item_key = (item.get("type"), item.get("id") or item.get("call_id"))
+                        if item_key[1] is None:
+                            item_key = (item_key[0], len(item_views))
+                        
+                        if item_messages:
+                            if not item_views:
+                                response_area.empty()
+                            item_views.update(
+                                item_key,
+                                item_messages,
+                                sum(len(str(msg["content"])) for msg in item_messages)
+                            )
+                            turn.rendered()
+
+            item_views.flush()
+            controls_area.empty()
+            return AssistantResponse(messages=partial_messages(), request_id=request_id)
+        except (RerunException, StopException):
+            _keep_interrupted_answer(*((partial_messages(), request_id) if item_views else previous_attempt))
+            raise
+        except Exception as e:
+            controls_area.empty()
+            messages, req_id = (partial_messages(), request_id) if item_views else previous_attempt
+            item_views.clear()
+            return _recover_from_stream_error(e, task_type, input_messages, response_area, messages, req_id, deadline, turn)
+        finally:
+            chunks.close()
+
+
+
+
+# --- Handle the prompt from the chat input created under the header ---
 if prompt:
     # Get the task type for this endpoint
     task_type = _get_endpoint_task_type(SERVING_ENDPOINT)
@@ -701,11 +698,19 @@ if prompt:
     st.session_state.history.append(user_msg)
     user_msg.render(len(st.session_state.history) - 1)
 
-    # Convert history to standard chat message format for the query methods
-    input_messages = [msg for elem in st.session_state.history for msg in elem.to_input_messages()]
+    # Convert history to the endpoint's input format for the query methods,
+    # keeping it within the context token budget. Responses endpoints get the
+    # per-message cached conversion so only the new prompt is converted.
+    if task_type == "agent/v1/responses":
+        input_messages = st.session_state.context_builder.build(
+            st.session_state.history, to_messages=Message.to_responses_input
+        )
+    else:
+        input_messages = st.session_state.context_builder.build(st.session_state.history)
     
     # Handle the response using the appropriate handler
     assistant_response = query_endpoint_and_render(task_type, input_messages)
     
-    # Add assistant response to history
-    st.session_state.history.append(assistant_response)
\ No newline at end of file
+    # Add assistant response to history (None when nothing could be streamed)
+    if assistant_response is not None:
+        st.session_state.history.append(assistant_response)
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+Background warm-up of the heavy SDK imports.
+
+databricks.sdk, mlflow.deployments and the MLflow pydantic types take
+several seconds to import on a cold container. The app modules import
+them lazily, so the header and chat input render right away, and this
+module preloads them (and builds the shared clients and the semantic
+cache) on a daemon thread started at the top of the script. By the time
+the first question arrives the work is usually done. If it isn't, Python's import lock makes the
+script wait for the import in progress instead of redoing it.
+
+Import cost can be broken down by module with:
+
+    python warm_start.py            # app modules and their heaviest dependencies
+    python warm_start.py --top 40   # show more modules
+"""
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WARM_START_ENABLED = os.getenv("WARM_START_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# In the order the app first needs them: the endpoint metadata lookup uses
+# the Databricks SDK, the first turn the deployments client and MLflow types
+PRELOAD_MODULES = (
+    "databricks.sdk",
+    "mlflow.deployments",
+    "mlflow.types.agent",
+    "mlflow.types.responses",
+)
+
+APP_MODULES = (
+    "app_config", "messages", "model_serving_utils", "client_registry", "endpoint_metadata",
+    "stream_render", "stream_reducers", "stream_parsers", "context_builder", "response_cache",
+    "semantic_cache", "feedback_queue", "retry_policy", "deadlines", "metrics", "admission",
+    "single_flight", "static_assets",
+)
+
+_lock = threading.Lock()
+_thread = None
+# module name -> seconds it took to import in the warm-up thread
+import_seconds = {}
+
+
+def _warm_up():
+    started = time.monotonic()
+    for module in PRELOAD_MODULES:
+        module_started = time.monotonic()
+        try:
+            __import__(module)
+        except Exception as e:
+            logger.warning(f"Warm start could not import {module}: {e}")
+            continue
+        import_seconds[module] = time.monotonic() - module_started
+    try:
+        # Authenticates and opens the connection pool before the first turn needs it
+        from client_registry import get_deploy_client
+        get_deploy_client()
+    except Exception as e:
+        logger.warning(f"Warm start could not build the deployments client: {e}")
+    try:
+        # Reads the index from disk, and loads SEMANTIC_CACHE_EMBEDDING_MODEL if one is set
+        from semantic_cache import get_semantic_cache
+        get_semantic_cache()
+    except Exception as e:
+        logger.warning(f"Warm start could not load the semantic cache: {e}")
+    logger.info(
+        f"Warm start finished in {time.monotonic() - started:.2f}s ("
+        + ", ".join(f"{module} {seconds:.2f}s" for module, seconds in import_seconds.items())
+        + ")"
+    )
+
+
+def start_warm_start():
+    """Start the warm-up thread, once per process."""
+    global _thread
+    if not WARM_START_ENABLED:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_warm_up, name="warm-start", daemon=True)
+        _thread.start()
+
+
+def wait_for_warm_start(timeout=None):
+    """Block until the warm-up thread is done; returns False on timeout."""
+    thread = _thread
+    if thread is None:
+        return True
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_time_report(modules=APP_MODULES + PRELOAD_MODULES):
+    """
+    Import `modules` in a fresh interpreter with -X importtime.
+
+    Returns (module, self seconds, cumulative seconds, nesting depth) tuples
+    in import order. The first import of a module is charged all of its cost,
+    so the order of `modules` matters.
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    code = "; ".join(f"import {module}" for module in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=base_dir, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "import failed")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us) / 1e6, int(cumulative_us) / 1e6, (len(indent) - 1) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=20, help="number of heaviest modules to list")
+    parser.add_argument("modules", nargs="*", help="modules to import (default: the app's modules)")
+    args = parser.parse_args()
+
+    rows = import_time_report(tuple(args.modules) or APP_MODULES + PRELOAD_MODULES)
+    requested = set(args.modules) or set(APP_MODULES + PRELOAD_MODULES)
+    top_level = [row for row in rows if row[3] == 0]
+    total = sum(row[2] for row in top_level)
+
+    print(f"Total import time: {total:.3f}s\n")
+    print("Requested modules (cumulative, in import order; * = pulled in by an earlier one):")
+    for module, _, cumulative, depth in rows:
+        if module in requested:
+            print(f"  {cumulative:8.3f}s  {module}{' *' if depth else ''}")
+    print(f"\nHeaviest {args.top} modules (cumulative):")
+    for module, self_seconds, cumulative, depth in sorted(rows, key=lambda row: -row[2])[:args.top]:
+        print(f"  {cumulative:8.3f}s  (self {self_seconds:.3f}s)  {'  ' * depth}{module}")
+
+
+if __name__ == "__main__":
+    main()